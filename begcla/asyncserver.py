@@ -0,0 +1,280 @@
+import asyncio
+import time
+import signal
+from struct import unpack
+from begcla.commands.cmd_server import Client, Packet, PredictionServer
+from begcla.wire import splitHeader, MAX_BODY_SIZE
+from begcla.framing import FramingException
+from begcla.scheduler import ServerBusyException, DeadlineExceededException
+
+class AsyncClient(Client):
+    def __init__(self, reader, writer, addr, server, idleTimeout=30, maxFrameSize=MAX_BODY_SIZE):
+        Client.__init__(self, None, addr, server, 0, idleTimeout, maxFrameSize)
+        self.maxFrameSize = maxFrameSize
+        self.reader = reader
+        self.writer = writer
+
+    async def awaitPacketAsync(self, timeout):
+        """Recieve a packet from the client.
+        
+        Arguments:
+            timeout {float} -- Seconds to wait for the start of the packet.
+        
+        Returns:
+            Packet -- Packet recieved, None if the server started draining first.
+        """
+        loop = asyncio.get_event_loop()
+        sizing = loop.create_task(self.reader.readexactly(4))
+        draining = loop.create_task(self.server.draining.wait())
+        (done, _) = await asyncio.wait([sizing, draining], timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        draining.cancel()
+
+        if sizing not in done:
+            sizing.cancel()
+            if draining in done:
+                return None
+            raise asyncio.TimeoutError()
+
+        sized = sizing.result()
+        start = time.perf_counter()
+        (size, flags) = splitHeader(unpack('<I', sized)[0])
+
+        self.server.log.debug("packet size: " + str(size))
+
+        if size > self.maxFrameSize:
+            raise FramingException('Frame of %d bytes exceeds the max frame size of %d bytes.' % (size, self.maxFrameSize))
+
+        dataBytes = await self.reader.readexactly(size)
+        self.server.metrics.observe('receive', time.perf_counter() - start)
+        return Packet.Parse(dataBytes, flags)
+
+    async def sendPacketAsync(self, packet):
+        self.server.countResponse(packet.data)
+
+        with self.server.metrics.timer('serialize'):
+            data = packet.makePacket()
+
+        start = time.perf_counter()
+        self.writer.write(data)
+        await self.writer.drain()
+        self.server.metrics.observe('send', time.perf_counter() - start)
+
+    async def _predictChunkAsync(self, chunk, model):
+        loop = asyncio.get_event_loop()
+        result = await loop.run_in_executor(self.server.streamExecutor, self._predictLogins, chunk, model)
+        return (chunk, result)
+
+    async def _streamPredictAsync(self, data, model):
+        # the chunks are awaited on the loop, no thread waits on them while they are classified
+        summary = {
+            'total': len(data['logins']),
+            'succeeded': 0,
+            'failed': 0
+        }
+        errors = []
+        chunks = [self._predictChunkAsync(chunk, model) for chunk in self._streamChunks(data['logins'])]
+
+        try:
+            for completed in asyncio.as_completed(chunks):
+                (chunk, result) = await completed
+                result = Client._countChunk(summary, errors, chunk, result)
+                if result is not None:
+                    yield result
+        except Exception as e:
+            self.server.log.error('Streamed predict failed: ' + str(e), stack_info=e)
+            yield Client.makeError(Client.ERROR_UNKNOWN)
+            return
+
+        yield Client._streamDone(summary, errors)
+
+    async def _sendResponseAsync(self, response, data, binary):
+        # echo the request id so pipelined responses can be matched
+        if 'id' in data:
+            response['id'] = data['id']
+        await self.sendPacketAsync(Packet(response, binary))
+
+    async def streamAsync(self, data, binary):
+        """Send a streamed prediction, each chunk as soon as it is classified.
+        
+        Arguments:
+            data {dict} -- Request data.
+            binary {bool} -- Whether to answer in the binary encoding.
+        
+        Raises:
+            ServerBusyException -- The server's work queue is full.
+            DeadlineExceededException -- The request waited past its deadline.
+        """
+        # opening the stream is scheduled like any request, so streams are admitted through the same queue
+        job = self.server.scheduler.submit(self._openStream, data, deadline=self.server.getDeadline(data))
+        (error, model) = await asyncio.wrap_future(job)
+
+        if error is not None:
+            await self._sendResponseAsync(error, data, binary)
+            return
+
+        async for response in self._streamPredictAsync(data, model):
+            await self._sendResponseAsync(response, data, binary)
+
+    async def handle(self):
+        try:
+            while True:
+                try:
+                    packet = await self.awaitPacketAsync(self.idleTimeout)
+                except asyncio.TimeoutError:
+                    self.server.log.debug('Client %d idle for %d seconds, closing.' % (self.id, self.idleTimeout))
+                    await self.sendPacketAsync(Packet(Client.IDLE_CLOSE))
+                    return
+                except asyncio.IncompleteReadError:
+                    self.server.log.debug('Client %d closed the connection.' % (self.id))
+                    return
+
+                if packet is None:
+                    self.server.log.debug('Server shutting down, closing idle client %d.' % (self.id))
+                    await self.sendPacketAsync(Packet(Client.SHUTDOWN_CLOSE))
+                    return
+
+                # db and inference work runs on the server's worker pool
+                try:
+                    if Client._isStream(packet.data):
+                        await self.streamAsync(packet.data, packet.binary)
+                        (responses, keepalive) = ([], Client._isKeepalive(packet.data))
+                    else:
+                        (responses, keepalive) = await asyncio.wrap_future(self.submitRequest(packet.data))
+                except ServerBusyException:
+                    self.server.log.warn('Work queue full, client %d is told to back off.' % (self.id))
+                    (responses, keepalive) = self.reject(packet.data, Client.ERROR_BUSY)
+                except DeadlineExceededException:
+                    (responses, keepalive) = self.reject(packet.data, Client.ERROR_DEADLINE)
+
+                for response in responses:
+                    await self.sendPacketAsync(Packet(response, packet.binary))
+
+                if not keepalive:
+                    return
+        except Exception as e:
+            self.server.log.error('Client %d failed: %s' % (self.id, str(e)), stack_info=e)
+        finally:
+            self.server.log.debug('Client %d finished.' % (self.id))
+            self.writer.close()
+            self.server.removeClient(self.id)
+
+class AsyncPredictionServer(PredictionServer):
+    def __init__(self, config, log, registry, args, listenSocket=None):
+        """Prediction server handling all connections on a single asyncio event
+        loop, while database lookups and inference run on the worker pool.
+        """
+        PredictionServer.__init__(self, config, log, registry, args, listenSocket)
+        self.clientTasks = set()
+        self.draining = None
+
+    async def _handle(self, csocket, caddress, slots, idleTimeout, maxFrameSize):
+        try:
+            (reader, writer) = await asyncio.open_connection(sock=csocket)
+            client = AsyncClient(reader, writer, caddress, self, idleTimeout, maxFrameSize)
+            client.id = self.addClient(client)
+            await client.handle()
+        finally:
+            slots.release()
+
+    async def _accept(self):
+        loop = asyncio.get_event_loop()
+        rejectOnMaxClients = self.config['Server']['RejectOnMaxClients'].lower() == 'true'
+        maxClients = int(self.config['Server']['MaxClients'])
+        idleTimeout = float(self.config['Server'].get('IdleTimeout', '30'))
+        maxFrameSize = int(self.config['Server'].get('MaxFrameSize', '1048576'))
+        slots = asyncio.Semaphore(maxClients)
+
+        while True:
+            if not rejectOnMaxClients:
+                # stop accepting until a slot frees up, pending connections wait in the backlog
+                await slots.acquire()
+
+            (csocket, caddress) = await loop.sock_accept(self.socket)
+            accepted = time.perf_counter()
+            self.metrics.increment('connections')
+            self.log.debug('Accept client: %s' % (str(caddress)))
+
+            if rejectOnMaxClients:
+                if slots.locked():
+                    self.log.warn('Max clients exceeded, rejecting client.')
+                    try:
+                        response = Client.makeError(Client.ERROR_BUSY)
+                        self.countResponse(response)
+                        await loop.sock_sendall(csocket, Packet(response).makePacket())
+                    except Exception as e:
+                        self.log.debug('Failed to send busy response: ' + str(e))
+                    finally:
+                        csocket.close()
+                    continue
+
+                await slots.acquire()
+
+            task = loop.create_task(self._handle(csocket, caddress, slots, idleTimeout, maxFrameSize))
+            self.clientTasks.add(task)
+            task.add_done_callback(self.clientTasks.discard)
+            self.metrics.observe('accept', time.perf_counter() - accepted)
+
+    async def _drainAsync(self, timeout):
+        # keepalive clients waiting for their next request are told to close
+        self.draining.set()
+
+        if len(self.clientTasks) > 0:
+            self.log.info('Waiting up to %d seconds for %d clients to finish ...' % (timeout, len(self.clientTasks)))
+            await asyncio.wait(list(self.clientTasks), timeout=timeout)
+
+    def serve(self):
+        drainTimeout = float(self.config['Server'].get('DrainTimeout', '10'))
+
+        # setup socket
+        if self.socket is None:
+            self.socket = PredictionServer.makeListenSocket(self.config, self.log)
+        self.socket.setblocking(False)
+
+        self.log.debug('Starting batch dispatcher ...')
+        self.dispatcher.start()
+        self.scheduler.start()
+        self.registry.start()
+
+        if self.featureStore is not None:
+            self.featureStore.start()
+
+        if self.metricsServer is not None:
+            self.metricsServer.start()
+
+        self.log.debug('Waiting for connections ...')
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.draining = asyncio.Event()
+        acceptTask = loop.create_task(self._accept())
+
+        # SIGTERM stops accepting, clients in progress are drained below
+        try:
+            loop.add_signal_handler(signal.SIGTERM, acceptTask.cancel)
+        except (NotImplementedError, RuntimeError, ValueError):
+            self.log.debug('Not handling SIGTERM outside the main thread.')
+
+        try:
+            loop.run_until_complete(acceptTask)
+        except asyncio.CancelledError:
+            self.log.info('SIGTERM, closing down ...')
+        except KeyboardInterrupt:
+            self.log.info('SIGINT, closing down ...')
+        except SystemExit:
+            # raised by _raiseExit, when SIGTERM can't be handled on the loop
+            self.log.info('SIGTERM, closing down ...')
+        except Exception as e:
+            self.log.error('Error: ' + str(e), stack_info=e)
+
+        acceptTask.cancel()
+        self.socket.close()
+        loop.run_until_complete(self._drainAsync(drainTimeout))
+
+        self.registry.stop()
+        self.scheduler.stop()
+        self.dispatcher.stop()
+        if self.featureStore is not None:
+            self.featureStore.stop()
+        if self.metricsServer is not None:
+            self.metricsServer.stop()
+        self.db.pool.close()
@@ -0,0 +1,117 @@
+import time
+from collections import OrderedDict
+from threading import RLock
+
+class PredictionCache:
+    def __init__(self, maxEntries, ttl):
+        """Thread-safe LRU cache of predictions with a time to live.
+        
+        Arguments:
+            maxEntries {int} -- Max number of cached predictions, least recently used are evicted first.
+            ttl {float} -- Seconds a prediction stays valid.
+        """
+        self.maxEntries = maxEntries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.models = set()
+        self.lock = RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, modelId, login):
+        """Get a cached prediction.
+        
+        Arguments:
+            modelId {string} -- Identity of the model that made the prediction.
+            login {string} -- Login name of player.
+        
+        Returns:
+            list -- The prediction, None if not cached or expired.
+        """
+        key = (modelId, login.lower())
+
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    del self.entries[key]
+
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, modelId, login, prediction):
+        # logins are matched case-insensitively, like the database does
+        key = (modelId, login.lower())
+
+        with self.lock:
+            self.models.add(modelId)
+            self.entries[key] = (time.time() + self.ttl, prediction)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, logins):
+        """Remove the cached predictions of players for all models.
+        
+        Arguments:
+            logins {list} -- Login names of players.
+        
+        Returns:
+            int -- Number of removed predictions.
+        """
+        removed = 0
+
+        with self.lock:
+            for login in logins:
+                for modelId in self.models:
+                    if self.entries.pop((modelId, login.lower()), None) is not None:
+                        removed += 1
+
+        return removed
+
+    def hasModel(self, modelId):
+        with self.lock:
+            return modelId in self.models
+
+    def retainModels(self, modelIds):
+        """Remove the cached predictions of models that are no longer loaded.
+        
+        Arguments:
+            modelIds {list} -- Identities of the loaded models.
+        
+        Returns:
+            int -- Number of removed predictions.
+        """
+        modelIds = set(modelIds)
+
+        with self.lock:
+            stale = self.models - modelIds
+            if len(stale) == 0:
+                return 0
+
+            keys = [key for key in self.entries if key[0] in stale]
+            for key in keys:
+                del self.entries[key]
+
+            self.models -= stale
+            return len(keys)
+
+    def getStats(self):
+        with self.lock:
+            total = self.hits + self.misses
+
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': 0 if total == 0 else self.hits / total,
+                'evictions': self.evictions
+            }
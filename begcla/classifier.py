@@ -1,10 +1,25 @@
 import numpy as np
+from begcla.features import FeatureSchema
+from begcla.metrics import Metrics
 
 class Classifier:
-    def __init__(self, db, model, dataValues):
+    def __init__(self, db, model, dataValues, metrics=None):
         self.db = db
+        self.metrics = metrics if metrics is not None else Metrics()
         self.model = model
         self.dataValues = dataValues
+        self.schema = FeatureSchema(dataValues)
+
+    def predict(self, points):
+        """Run the model on a list of datapoints.
+        
+        Arguments:
+            points {list} -- Datapoints to classify.
+        
+        Returns:
+            ndarray -- Prediction row ([experienced, beginner]) of each datapoint.
+        """
+        return self.model.predict(np.array(points, dtype=np.float32))
     
     def classify(self, login):
         stats = self.db.getPlayerStats(login)
@@ -12,25 +27,49 @@ class Classifier:
         if stats == None:
             return None
 
-        point = []
-
-        if "visits" in self.dataValues:
-            point.append(float(stats['visits']))
-        if "play_time" in self.dataValues:
-            point.append(float(stats['play_time']))
-        if "finishes" in self.dataValues:
-            point.append(float(stats['finishes']))
-        if "locals" in self.dataValues:
-            point.append(float(stats['locals']))
-        if "wins" in self.dataValues:
-            point.append(float(stats['wins']))
-        if "score" in self.dataValues:
-            point.append(float(stats['score']))
-        if "rank" in self.dataValues:
-            point.append(float(stats['rank']))
-        if "record_rank_avg" in self.dataValues:
-            point.append(float(stats['record_rank_avg']))
-        if "num_pbs" in self.dataValues:
-            point.append(float(stats['num_pbs']))
+        return self.predict(self.schema.fromStats([stats]))
+
+    def getFeatures(self, logins):
+        """Get the datapoints of several players.
+        
+        Arguments:
+            logins {list} -- Login names of players.
+        
+        Returns:
+            dict -- Datapoint of each login, None if the player was not found.
+        """
+        with self.metrics.timer('db_fetch'):
+            stats = self.db.getPlayerStatsBulk(logins)
+        if stats is None:
+            stats = {}
+
+        found = [login for login in logins if stats.get(login) is not None]
+        with self.metrics.timer('feature_build'):
+            matrix = self.schema.fromStats([stats[login] for login in found])
+
+        points = dict.fromkeys(logins)
+        for (i, login) in enumerate(found):
+            points[login] = matrix[i]
+
+        return points
+
+    def classifyMany(self, logins):
+        """Classify several players using a single model prediction.
+        
+        Arguments:
+            logins {list} -- Login names of players.
         
-        return self.model.predict(np.array([point]))
+        Returns:
+            dict -- Prediction row ([experienced, beginner]) of each login, None if the player was not found.
+        """
+        points = self.getFeatures(logins)
+        results = dict.fromkeys(points)
+        found = [login for login in points if points[login] is not None]
+
+        if len(found) > 0:
+            predictions = self.predict([points[login] for login in found])
+
+            for i, login in enumerate(found):
+                results[login] = predictions[i]
+
+        return results
@@ -1,10 +1,13 @@
-import numpy as np
 import os
 import json
 import sys
 from begcla.database import EvoSCDB
 from begcla.classifier import Classifier
-from begcla.commands.cmd_server import Client, Packet, PredictionServer
+from begcla.inference import loadModel, getModelDataValues, getModelInputSize
+from begcla.features import FeatureSchema, FeatureSchemaException
+from begcla.commands.cmd_server import Packet
+from begcla.framing import FramedSocket, FramingException
+from begcla.wire import makePredictRequest
 import socket
 
 class CmdClassify:
@@ -15,6 +18,43 @@ class CmdClassify:
         self.db = None
         self.log.name = "BeginnerClassifierClient"
 
+    def _printPrediction(self, prediction):
+        if 'success' in prediction and prediction['success'] == False:
+            print("[-] Error: " + prediction['error'])
+            return
+
+        if prediction['beginner'] > 0.5:
+            print("[+] %s is a beginner (%s%% sure)" % (prediction['login'], round(prediction['beginner']*100, 2)))
+        else:
+            print("[+] %s is experienced (%s%% sure)" % (prediction['login'], round(prediction['experienced']*100, 2)))
+
+    def _printStream(self, framed):
+        # print partial results as they arrive, until the end-of-stream frame
+        while True:
+            frame = framed.recvFrame()
+            if frame is None:
+                raise FramingException('Server closed the connection.')
+
+            response = Packet.Parse(frame[1], frame[0])
+
+            if self.args.json:
+                print(json.dumps(response.data))
+                sys.stdout.flush()
+            elif response.data['errno'] > 0:
+                print('[-] Error: ' + str(response.data['error']))
+            elif response.data.get('partial', False):
+                for prediction in response.data['predictions']:
+                    self._printPrediction(prediction)
+                sys.stdout.flush()
+            elif response.data.get('done', False):
+                summary = response.data['summary']
+                for error in response.data['errors']:
+                    print('[-] Error for %d players: %s' % (len(error['logins']), error['error']))
+                print('[+] %d of %d players classified.' % (summary['succeeded'], summary['total']))
+
+            if response.data['errno'] > 0 or response.data.get('done', False):
+                return
+
     def run(self):
         result = {}
 
@@ -25,19 +65,28 @@ class CmdClassify:
             address = self.config['Server']['ListenAddress']
             port = int(self.config['Server']['ListenPort'])
             dataBlockSize = int(self.config['Server']['DataBlockSize'])
+            maxFrameSize = int(self.config['Server'].get('MaxFrameSize', '1048576'))
 
             try:
                 sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                 sock.connect((address, port))
-                client = Client(sock, address, PredictionServer(self.config, self.log, None, self.args), dataBlockSize)
+                framed = FramedSocket(sock, maxFrameSize, dataBlockSize)
 
-                packet = Packet({
-                    'request': 'predict',
-                    'logins': self.args.player_logins
-                })
-                client.sendPacket(packet)
+                packet = Packet(makePredictRequest(self.args.player_logins, self.args.stream), self.args.binary)
+                framed.send(packet.makePacket())
+
+                if self.args.stream:
+                    self._printStream(framed)
+                    sock.close()
+                    return
+
+                frame = framed.recvFrame()
+                if frame is None:
+                    raise FramingException('Server closed the connection.')
+
+                response = Packet.Parse(frame[1], frame[0])
+                sock.close()
 
-                response = client.awaitPacket()
                 if response.data['errno'] > 0:
                     if self.args.json:
                         print(json.dumps(response.data))
@@ -45,7 +94,6 @@ class CmdClassify:
                         print('[-] Error: ' + str(response.data['error']))
                     return
                 
-                sock.close()
                 result['predictions'] = response.data['predictions']
             except Exception as e:
                 if self.args.json:
@@ -59,23 +107,32 @@ class CmdClassify:
 
         elif os.path.exists(self.args.model_file):
             self.log.debug('Don\'t use server.')
-            os.environ['TF_CPP_MIN_LOG_LEVEL'] = '10'
-            stderr = sys.stderr
-            sys.stderr = open(os.devnull, 'w')
-            from keras.models import load_model
-            sys.stderr = stderr
+            if self.args.backend == 'keras':
+                os.environ['TF_CPP_MIN_LOG_LEVEL'] = '10'
+                stderr = sys.stderr
+                sys.stderr = open(os.devnull, 'w')
+                import keras
+                sys.stderr = stderr
 
             data_values = self.args.dt_values.split(',')
             self.db = EvoSCDB(self.config, self.log, data_values)
 
-            self.log.info("Loading model %s" % (self.args.model_file))
-            model = load_model(self.args.model_file)
+            self.log.info("Loading model %s (%s backend)" % (self.args.model_file, self.args.backend))
+            model = loadModel(self.args.model_file, self.args.backend)
+
+            try:
+                FeatureSchema(data_values).checkModel(getModelDataValues(self.args.model_file), getModelInputSize(model))
+            except FeatureSchemaException as e:
+                print("[-] The model does not match --dt-values: " + str(e))
+                return
             result['predictions'] = []
             
             classifier = Classifier(self.db, model, data_values)
 
+            predictions = classifier.classifyMany(self.args.player_logins)
+
             for login in self.args.player_logins:
-                prediction = classifier.classify(login)
+                prediction = predictions[login]
                 
                 if prediction is None:
                     print("[-] Failed to classify player '%s'. Player probably doesn't exist." % (login))
@@ -83,8 +140,8 @@ class CmdClassify:
 
                 result['predictions'].append({
                     'login': login,
-                    'experienced': float(prediction[0][0]),
-                    'beginner': float(prediction[0][1]),
+                    'experienced': float(prediction[0]),
+                    'beginner': float(prediction[1]),
                 })
         else:
             print("[-] The model file '%s' does not exist." % (self.args.model_file))
@@ -97,12 +154,5 @@ class CmdClassify:
             self.log.debug('Printed json.')
         else:
             for prediction in result['predictions']:
-                if 'success' in prediction and prediction['success'] == False:
-                    print("[-] Error: " + prediction['error'])
-                    continue
-
-                if prediction['beginner'] > 0.5:
-                    print("[+] %s is a beginner (%s%% sure)" % (prediction['login'], round(prediction['beginner']*100, 2)))
-                else:
-                    print("[+] %s is experienced (%s%% sure)" % (prediction['login'], round(prediction['experienced']*100, 2)))
+                self._printPrediction(prediction)
             self.log.debug('Printed user-friendly output.')
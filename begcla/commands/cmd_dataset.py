@@ -1,14 +1,20 @@
-from begcla.database import EvoSCDB
+from begcla.database import EvoSCDB, ConnectionPool
+from begcla.features import FEATURES, DATASET_COLUMNS
+from begcla.dataset import iterVoteRows
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
 import os
-import json
 import sys
+import time
 
 class CmdDataset:
     def __init__(self, args, config, log):
         self.log = log
         self.args = args
         self.config = config
-        self.db = EvoSCDB(config, log, 'visits,play_time,finishes,locals,wins,score,rank,record_rank_avg,num_pbs'.split(','))
+        # one connection per worker, so no worker waits out PoolTimeout and drops its batch
+        poolSize = max(args.workers, int(config['Database'].get('PoolSize', '4')))
+        self.db = EvoSCDB(config, log, FEATURES, ConnectionPool(config, log, poolSize))
 
     def _menu(self):
         while True:
@@ -23,6 +29,10 @@ class CmdDataset:
             except Exception:
                 print('Invalid option.')
 
+    def _writeDataPoint(self, f, player, isBeginner):
+        f.write(','.join([str(player[name]) for name in DATASET_COLUMNS[:-1]]) + ',')
+        f.write(str(1 if isBeginner else 0) + "\n")
+
     def addDataPoint(self, login, isBeginner):
         player = self.db.getPlayerStats(login)
         if player is None:
@@ -32,19 +42,113 @@ class CmdDataset:
         self.log.info("Adding datapoint for player '%s'" % (login))
 
         with open(self.args.dataset_file, 'a+') as f:
-            f.write(str(player['id']) + ',')
-            f.write(str(player['visits']) + ',')
-            f.write(str(player['play_time']) + ',')
-            f.write(str(player['finishes']) + ',')
-            f.write(str(player['locals']) + ',')
-            f.write(str(player['wins']) + ',')
-            f.write(str(player['score']) + ',')
-            f.write(str(player['rank']) + ',')
-            f.write(str(player['record_rank_avg']) + ',')
-            f.write(str(player['num_pbs']) + ',')
-            f.write(str(1 if isBeginner else 0) + "\n")
+            self._writeDataPoint(f, player, isBeginner)
+
+    def _readExistingIds(self):
+        ids = set()
+
+        if not os.path.exists(self.args.dataset_file):
+            return ids
+
+        with open(self.args.dataset_file, 'r') as f:
+            for line in f:
+                playerId = line.split(',', 1)[0].strip()
+                if playerId != '':
+                    ids.add(playerId)
+
+        return ids
+
+    def _fetchBatch(self, batch):
+        try:
+            return self.db.getPlayerStatsBulk([login for (login, _) in batch])
+        except Exception as e:
+            self.log.error('Failed fetching stats of %d players: %s' % (len(batch), str(e)))
+            return None
+
+    def _writeBatch(self, f, batch, players, ids, counts):
+        if players is None:
+            counts['failed'] += len(batch)
+            return
+
+        for (login, isBeginner) in batch:
+            player = players.get(login)
+
+            if player is None:
+                self.log.debug("Player '%s' not found." % (login))
+                counts['missing'] += 1
+            elif str(player['id']) in ids:
+                counts['duplicate'] += 1
+            else:
+                ids.add(str(player['id']))
+                self._writeDataPoint(f, player, isBeginner)
+                counts['written'] += 1
+
+    def buildFromJson(self, fname, batchSize, workers):
+        """Add datapoints for all players of a vote export, fetching their stats
+        in batches on several database workers.
+        
+        Players already in the dataset file (by player id) are skipped.
+        
+        Arguments:
+            fname {string} -- Path to the vote export (json_db.json format).
+            batchSize {int} -- Number of players fetched per database query.
+            workers {int} -- Max number of concurrent database lookups.
+        
+        Returns:
+            dict -- Number of written, duplicate, missing and failed players.
+        """
+        ids = self._readExistingIds()
+        counts = {'written': 0, 'duplicate': 0, 'missing': 0, 'failed': 0}
+        pending = deque()
+        processed = 0
+        start = time.time()
+
+        print("[+] %d players already in %s" % (len(ids), self.args.dataset_file))
+
+        def report():
+            elapsed = max(time.time() - start, 0.001)
+            sys.stdout.write("Players: %d (written: %d, duplicates: %d, not found: %d, failed: %d) - %.1f players/s     \r" % (
+                processed, counts['written'], counts['duplicate'], counts['missing'], counts['failed'], processed / elapsed))
+            sys.stdout.flush()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor, open(self.args.dataset_file, 'a+', buffering=1 << 16) as f:
+            def flush(untilSize):
+                nonlocal processed
+                # write results in input order, bounding the number of batches in flight
+                while len(pending) > untilSize:
+                    (batch, future) = pending.popleft()
+                    self._writeBatch(f, batch, future.result(), ids, counts)
+                    processed += len(batch)
+                    report()
+
+            batch = []
+            for row in iterVoteRows(fname):
+                batch.append(row)
+
+                if len(batch) >= batchSize:
+                    pending.append((batch, executor.submit(self._fetchBatch, batch)))
+                    batch = []
+                    flush(workers * 2)
+
+            if len(batch) > 0:
+                pending.append((batch, executor.submit(self._fetchBatch, batch)))
+
+            flush(0)
+
+        report()
+        print("\n[+] Done in %.1f seconds." % (time.time() - start))
+
+        return counts
 
     def run(self):
+        if self.args.from_json is not None:
+            if not os.path.exists(self.args.from_json):
+                print("[-] The file '%s' does not exist." % (self.args.from_json))
+                return
+
+            self.buildFromJson(self.args.from_json, self.args.batch_size, self.args.workers)
+            return
+
         while True:
             opt = self._menu()
 
@@ -52,17 +156,8 @@ class CmdDataset:
                 fname = input('File: ')
                 if not os.path.exists(fname):
                     print('[+] File does not exist.')
-                with open (fname, 'r') as f:
-                    data = json.loads(f.read())
-                    totalPlayers = len(data['rows'])
-                    print("Total players to check: " + str(totalPlayers))
-                    currPlayer = 1
-                    for row in data['rows']:
-                        sys.stdout.write("Player: %s (%s/%s - %s%%)               \r" % (row['name'], str(currPlayer), str(totalPlayers), str(round(currPlayer/totalPlayers, 2))))
-                        sys.stdout.flush()
-                        self.addDataPoint(row['name'], True if row['votes'] == 'beginner' else False)
-                        currPlayer += 1
-                    print("\n[+] Done!")
+                    continue
+                self.buildFromJson(fname, self.args.batch_size, self.args.workers)
             elif opt == 2:
                 login = input('Player Login: ')
                 isBeginner = True if input('Beginner?: ').lower() == 'y' else False
@@ -0,0 +1,43 @@
+import os
+from begcla.inference import NumpyModel, getModelDataValues, getModelInputSize
+from begcla.features import FeatureSchema, FeatureSchemaException
+
+class CmdExport:
+    def __init__(self, args, config, log):
+        self.log = log
+        self.args = args
+        self.config = config
+
+    def run(self):
+        if not os.path.exists(self.args.model_file):
+            print("[-] The model file '%s' does not exist." % (self.args.model_file))
+            return
+
+        dtype = 'float16' if self.args.float16 else 'float32'
+
+        # use the data-point values recorded in the model when available
+        dataValues = getModelDataValues(self.args.model_file)
+        if dataValues is None and self.args.dt_values is None:
+            print("[-] The model does not record its data-point values, specify them with --dt-values.")
+            return
+
+        model = NumpyModel.load(self.args.model_file)
+
+        try:
+            schema = FeatureSchema(dataValues if dataValues is not None else self.args.dt_values.split(','))
+            schema.checkModel(None, getModelInputSize(model))
+            if self.args.dt_values is not None:
+                FeatureSchema(self.args.dt_values.split(',')).checkModel(schema.names, None)
+        except FeatureSchemaException as e:
+            print("[-] " + str(e))
+            return
+
+        print("[+] Model: " + str(self.args.model_file))
+        print("[+] Datapoint values: " + str(schema))
+        print("[+] Weight type: " + dtype)
+        print("[+] Output File: " + str(self.args.out_file))
+
+        model.dataValues = schema.names
+        model.export(self.args.out_file, dtype)
+
+        print("[+] Exported %d layers (%d bytes)." % (len(model.layers), os.path.getsize(self.args.out_file)))
@@ -1,5 +1,22 @@
 import numpy as np
 import os
+from begcla.dataset import loadRows, hashRows
+from begcla.pipeline import TrainingPipeline, expandShards, isValidation
+from begcla.features import FeatureSchema, FeatureSchemaException
+from begcla.inference import NumpyModel, recordModelDataValues, recordModelRows, getModelDataValues, getModelRows, getModelInputSize
+
+# defaults of the model options, also used for options a sweep doesn't vary
+DEFAULT_OPTIONS = {
+    'batch_size': 100,
+    'epochs': 32,
+    'outlayer_activation': 'softmax',
+    'inner_layers': ['50:sigmoid'],
+    'inlayer_size': 32,
+    'inlayer_activation': 'relu',
+    'optimizer': 'rmsprop',
+    'loss': 'binary_crossentropy',
+    'metrics': ['accuracy']
+}
 
 class CmdModel:
     def __init__(self, args, config, log):
@@ -7,16 +24,61 @@ class CmdModel:
         self.args = args
         self.config = config
 
-    def run(self):
-        import keras
-        from keras.models import Sequential
-        from keras.layers import Dense, Activation
+    def _selectRows(self, rows, hashes, known):
+        # new or changed datapoints, plus a sample of the ones the model was trained on
+        isNew = ~np.isin(hashes, known)
+        new = np.flatnonzero(isNew)
+        old = np.flatnonzero(~isNew)
+
+        numReplay = min(len(old), int(round(len(new) * self.args.replay)))
+        replay = np.random.choice(old, numReplay, replace=False)
+        print("[+] Fine-tuning on %d new or changed datapoints and %d replayed ones." % (len(new), numReplay))
+
+        return rows[np.sort(np.concatenate([new, replay]))]
+
+    def _loadInMemory(self, shards, schema, cacheDir, known=None):
+        rows = np.concatenate([loadRows(shard, self.log, cacheDir) for shard in shards])
+        validation = isValidation(rows[:, 0], self.args.validation_split)
+
+        trainRows = rows[~validation]
+        validationRows = rows[validation]
+        hashes = hashRows(trainRows)
+        print("[+] Loaded %d datapoints (%d for validation)." % (len(rows), len(validationRows)))
+
+        if known is not None:
+            trainRows = self._selectRows(trainRows, hashes, known)
+
+        return ((schema.fromRows(trainRows), trainRows[:, -1].astype(np.int64)), (schema.fromRows(validationRows), validationRows[:, -1].astype(np.int64)), hashes)
 
-        if not os.path.exists(self.args.dataset_file):
-            print("[+] The dataset file '%' can't be found." % (self.args.dataset_file))
+    def _checkResume(self, schema):
+        # make sure the model can be fine-tuned on the requested data-point values
+        modelfile = self.args.resume_from
+
+        if not os.path.exists(modelfile):
+            print("[-] The model file '%s' does not exist." % (modelfile))
+            return False
+
+        if NumpyModel.isExported(modelfile):
+            print("[-] Exported models can't be trained, resume from the Keras .h5 model instead.")
+            return False
+
+        try:
+            schema.checkModel(getModelDataValues(modelfile), None)
+        except FeatureSchemaException as e:
+            print("[-] " + str(e))
+            return False
+
+        return True
+
+    def run(self):
+        shards = expandShards(self.args.dataset_file)
+        missing = [shard for shard in shards if not os.path.exists(shard)]
+        if len(missing) > 0:
+            print("[-] The dataset file '%s' can't be found." % (missing[0]))
+            return
 
         # print configuration
-        print("[+] Dataset: " + str(self.args.dataset_file))
+        print("[+] Dataset: " + ', '.join(shards))
         print("[+] Training Batch Size: " + str(self.args.batch_size))
         print("[+] Training Epochs: " + str(self.args.epochs))
         print("[+] Output Layer Activation: " + str(self.args.outlayer_activation))
@@ -27,55 +89,74 @@ class CmdModel:
         print("[+] Optimizer: " + str(self.args.optimizer))
         print("[+] Loss Function: " + str(self.args.loss))
         print("[+] Training Metrics: " + str(self.args.metrics))
+        print("[+] Validation Split: " + str(self.args.validation_split))
+        print("[+] Streaming: " + str(self.args.stream))
+        print("[+] Resume From: " + str(self.args.resume_from))
         print("[+] Output File: " + str(self.args.out_file))
 
         # form training data
-        data_values = self.args.db_values.split(',')
-
-        datapoints = np.array([])
-        labels = np.array([])
-
-        with open(self.args.dataset_file) as f:
-            for line in f.readlines():
-                entries = line.split(',')
-                point = []
-
-                if "visits" in data_values:
-                    point.append(float(entries[1]))
-                if "play_time" in data_values:
-                    point.append(float(entries[2]))
-                if "finishes" in data_values:
-                    point.append(float(entries[3]))
-                if "locals" in data_values:
-                    point.append(float(entries[4]))
-                if "wins" in data_values:
-                    point.append(float(entries[5]))
-                if "score" in data_values:
-                    point.append(float(entries[6]))
-                if "rank" in data_values:
-                    point.append(float(entries[7]))
-                if "record_rank_avg" in data_values:
-                    point.append(float(entries[8]))
-                if "num_pbs" in data_values:
-                    point.append(float(entries[9]))
-                
-                npPoint = np.array([np.array(point)])
-
-                if len(datapoints) == 0:
-                    datapoints = npPoint
-                else:
-                    datapoints = np.concatenate((datapoints, npPoint))
-                
-                labels = np.append(labels, entries[10])
+        try:
+            schema = FeatureSchema(self.args.db_values.split(','))
+        except FeatureSchemaException as e:
+            print("[-] " + str(e))
+            return
+
+        cacheDir = None
+        if not self.args.no_cache:
+            cacheDir = os.path.join(os.path.dirname(os.path.abspath(shards[0])), '.cache')
+
+        batchSize = int(self.args.batch_size)
+
+        if self.args.resume_from is not None:
+            if not self._checkResume(schema):
+                return
+
+            known = getModelRows(self.args.resume_from)
+            if known is None:
+                print("[-] The model does not record the datapoints it was trained on, fine-tuning on all of them.")
+                known = np.zeros(0, dtype=np.uint64)
+
+            # only the new datapoints and the replay sample are trained on, they fit in memory
+            (train, validation, hashes) = self._loadInMemory(shards, schema, cacheDir, known)
+            if len(train[0]) == 0:
+                print("[+] No new or changed datapoints, the model is up to date.")
+                return
+
+            self._train(schema, train=train, validation=validation, rowHashes=np.concatenate([known, hashes]))
+        elif self.args.stream:
+            # the parser processes are started before keras is loaded
+            with TrainingPipeline(shards, schema, self.log, batchSize, cacheDir, self.args.workers, self.args.shuffle_buffer, self.args.prefetch, self.args.validation_split) as pipeline:
+                (numTrain, numValidation) = pipeline.prepare()
+                print("[+] Streaming %d datapoints (%d for validation)." % (numTrain + numValidation, numValidation))
+
+                if numTrain == 0:
+                    print("[-] No datapoints to train on.")
+                    return
+
+                self._train(schema, pipeline=pipeline, rowHashes=pipeline.rowHashes)
+        else:
+            (train, validation, hashes) = self._loadInMemory(shards, schema, cacheDir)
+            self._train(schema, train=train, validation=validation, rowHashes=hashes)
+
+    @staticmethod
+    def buildModel(options, inputSize):
+        """Build and compile a model.
+        
+        Arguments:
+            options {object} -- Model options, with the attributes of the model command arguments.
+            inputSize {int} -- Number of features.
         
-        labels = keras.utils.to_categorical(labels, num_classes=2)
+        Returns:
+            Sequential -- Compiled Keras model.
+        """
+        from keras.models import Sequential
+        from keras.layers import Dense, Activation
 
-        # build model
         model = Sequential()
-        model.add(Dense(self.args.inlayer_size, input_dim=len(data_values)))
-        model.add(Activation(self.args.inlayer_activation))
+        model.add(Dense(int(options.inlayer_size), input_dim=inputSize))
+        model.add(Activation(options.inlayer_activation))
 
-        for layer in self.args.inner_layers:
+        for layer in options.inner_layers:
             info = layer.split(':')
             size = int(info[0])
             activation = info[1]
@@ -84,7 +165,31 @@ class CmdModel:
             model.add(Activation(activation))
         
         model.add(Dense(2))
-        model.add(Activation(self.args.outlayer_activation))
+        model.add(Activation(options.outlayer_activation))
+
+        model.compile(
+            optimizer=options.optimizer,
+            loss=options.loss,
+            metrics=options.metrics
+        )
+
+        return model
+
+    def _loadResume(self, schema):
+        from keras.models import load_model
+
+        # the model keeps its layers and weights, it is compiled with the given options
+        model = load_model(self.args.resume_from, compile=False)
+
+        try:
+            schema.checkModel(None, getModelInputSize(model))
+        except FeatureSchemaException as e:
+            print("[-] " + str(e))
+            return None
+
+        if model.output_shape[-1] != 2:
+            print("[-] Model has %d outputs instead of 2 (experienced, beginner)." % (model.output_shape[-1]))
+            return None
 
         model.compile(
             optimizer=self.args.optimizer,
@@ -92,6 +197,45 @@ class CmdModel:
             metrics=self.args.metrics
         )
 
+        return model
+
+    def _train(self, schema, train=None, validation=None, pipeline=None, rowHashes=None):
+        import keras
+
+        # build model, or continue training the one resumed from
+        if self.args.resume_from is not None:
+            model = self._loadResume(schema)
+            if model is None:
+                return
+        else:
+            model = CmdModel.buildModel(self.args, len(schema))
+
         # train the model
-        model.fit(datapoints, labels, epochs=int(self.args.epochs), batch_size=int(self.args.batch_size))
+        if pipeline is not None:
+            validationData = None
+            validationSteps = None
+            if pipeline.getSteps(True) > 0:
+                validationData = pipeline.generator(True)
+                validationSteps = pipeline.getSteps(True)
+
+            # older keras versions only take generators through fit_generator
+            fit = model.fit_generator if hasattr(model, 'fit_generator') else model.fit
+            fit(
+                pipeline.generator(),
+                steps_per_epoch=pipeline.getSteps(False),
+                epochs=int(self.args.epochs),
+                validation_data=validationData,
+                validation_steps=validationSteps
+            )
+        else:
+            (datapoints, labels) = train
+            validationData = None
+            if len(validation[0]) > 0:
+                validationData = (validation[0], keras.utils.to_categorical(validation[1], num_classes=2))
+
+            labels = keras.utils.to_categorical(labels, num_classes=2)
+            model.fit(datapoints, labels, epochs=int(self.args.epochs), batch_size=int(self.args.batch_size), validation_data=validationData)
+
         model.save(self.args.out_file)
+        recordModelDataValues(self.args.out_file, schema.names)
+        recordModelRows(self.args.out_file, rowHashes)
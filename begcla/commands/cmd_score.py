@@ -0,0 +1,138 @@
+import os
+import re
+import csv
+import json
+import time
+from begcla.database import EvoSCDB
+from begcla.classifier import Classifier
+from begcla.inference import loadModel, getModelDataValues, getModelInputSize
+from begcla.features import FeatureSchema, FeatureSchemaException
+
+class CmdScore:
+    def __init__(self, args, config, log):
+        self.log = log
+        self.args = args
+        self.config = config
+
+    def _readCheckpoint(self):
+        if self.args.checkpoint is None or not os.path.exists(self.args.checkpoint):
+            return None
+
+        with open(self.args.checkpoint, 'r') as f:
+            return json.loads(f.read())
+
+    def _outputMode(self):
+        return 'table' if self.args.table is not None else 'out'
+
+    def _writeCheckpoint(self, lastId, scored, offset):
+        if self.args.checkpoint is None:
+            return
+
+        # write to a temporary file first so a crash never leaves a broken checkpoint
+        tmpFile = self.args.checkpoint + '.tmp'
+        with open(tmpFile, 'w') as f:
+            f.write(json.dumps({
+                'last_id': lastId,
+                'scored': scored,
+                'offset': offset,
+                'mode': self._outputMode(),
+                'since': self.args.since
+            }))
+
+        os.replace(tmpFile, self.args.checkpoint)
+
+    def run(self):
+        if (self.args.out_file is None) == (self.args.table is None):
+            print("[-] Specify exactly one of --out or --table.")
+            return
+
+        if self.args.table is not None and re.match(r'^[A-Za-z0-9_\-]+$', self.args.table) is None:
+            print("[-] Invalid table name '%s'." % (self.args.table))
+            return
+
+        if not os.path.exists(self.args.model_file):
+            print("[-] The model file '%s' does not exist." % (self.args.model_file))
+            return
+
+        data_values = self.args.dt_values.split(',')
+        model = loadModel(self.args.model_file, self.args.backend)
+
+        try:
+            FeatureSchema(data_values).checkModel(getModelDataValues(self.args.model_file), getModelInputSize(model))
+        except FeatureSchemaException as e:
+            print("[-] The model does not match --dt-values: " + str(e))
+            return
+
+        db = EvoSCDB(self.config, self.log, data_values)
+        classifier = Classifier(db, model, data_values)
+        modelName = os.path.basename(self.args.model_file)
+
+        # resume from the last completed chunk
+        lastId = 0
+        scored = 0
+        checkpoint = self._readCheckpoint()
+        if checkpoint is not None:
+            if checkpoint.get('since') != self.args.since:
+                print("[-] The checkpoint was made with --since %s, remove it to start over." % (str(checkpoint.get('since'))))
+                return
+
+            if checkpoint.get('mode') != self._outputMode():
+                print("[-] The checkpoint was made with --%s, remove it to start over." % (str(checkpoint.get('mode'))))
+                return
+
+            lastId = checkpoint['last_id']
+            scored = checkpoint['scored']
+            print("[+] Resuming after player id %d (%d players scored)." % (lastId, scored))
+
+        out = None
+        writer = None
+        if self.args.out_file is not None:
+            if checkpoint is not None and os.path.exists(self.args.out_file):
+                # drop rows written after the checkpoint was saved
+                out = open(self.args.out_file, 'r+', buffering=1 << 16, newline='')
+                out.truncate(checkpoint['offset'])
+                out.seek(checkpoint['offset'])
+            else:
+                out = open(self.args.out_file, 'w', buffering=1 << 16, newline='')
+                out.write('id,login,experienced,beginner\n')
+
+            # logins may contain commas or quotes, let the csv module quote them
+            writer = csv.writer(out, lineterminator='\n')
+        else:
+            db.createClassificationsTable(self.args.table)
+
+        start = time.time()
+        startScored = scored
+
+        try:
+            for players in db.iterPlayerStats(self.args.chunk_size, lastId, self.args.since):
+                predictions = classifier.predict(classifier.schema.fromStats(players))
+
+                if out is not None:
+                    writer.writerows(
+                        (player['id'], player['login'], '%f' % prediction[0], '%f' % prediction[1])
+                        for (player, prediction) in zip(players, predictions)
+                    )
+                    out.flush()
+                else:
+                    db.saveClassifications(self.args.table, [
+                        (player['id'], player['login'], float(prediction[0]), float(prediction[1]), modelName)
+                        for (player, prediction) in zip(players, predictions)
+                    ])
+
+                scored += len(players)
+                lastId = players[-1]['id']
+                self._writeCheckpoint(lastId, scored, None if out is None else out.tell())
+
+                elapsed = max(time.time() - start, 0.001)
+                print("[+] Scored %d players (last id %d) - %.1f players/s" % (scored, lastId, (scored - startScored) / elapsed))
+        finally:
+            if out is not None:
+                out.close()
+            db.pool.close()
+
+        # the run completed, the next one starts from the beginning
+        if self.args.checkpoint is not None and os.path.exists(self.args.checkpoint):
+            os.remove(self.args.checkpoint)
+
+        print("[+] Done, scored %d players." % (scored))
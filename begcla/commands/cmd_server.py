@@ -1,30 +1,51 @@
 import socket
-from threading import Thread, RLock
-import numpy
+import select
+import signal
+import sys
+from threading import Thread, RLock, Condition
 import os
 import time
-from struct import pack, unpack
 from begcla.classifier import Classifier
-from begcla.database import EvoSCDB
+from begcla.registry import ModelRegistry
+from begcla.features import FeatureSchemaException
+from begcla.database import EvoSCDB, DatabaseException
+from begcla.dispatcher import BatchDispatcher
+from begcla.cache import PredictionCache
+from begcla.snapshot import FeatureStore
+from begcla.scheduler import RequestScheduler, ServerBusyException, DeadlineExceededException
+from begcla.metrics import Metrics, MetricsServer
 import json
+from queue import Queue
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from begcla.wire import FLAG_BINARY, MAX_BODY_SIZE, makeHeader, encodeBinary, decodeBinary
+from begcla.framing import FramedSocket
 
 class Packet:
-    def __init__(self, data):
+    def __init__(self, data, binary=False):
         self.data = data
+        self.binary = binary
     
     def makePacket(self):
-        body = json.dumps(self.data)
-        size = len(body)
+        body = None
+        flags = 0
 
-        bdata = pack('<I', size)
-        bdata += body.encode('utf8')
+        # fall back to json for data the binary format doesn't cover
+        if self.binary:
+            body = encodeBinary(self.data)
+            if body is not None:
+                flags |= FLAG_BINARY
 
-        return bdata
+        if body is None:
+            body = json.dumps(self.data).encode('utf8')
+
+        return makeHeader(len(body), flags) + body
 
     @staticmethod
-    def Parse(dataBytes):
-        datastr = dataBytes.decode('utf8')
-        data = json.loads(datastr)
+    def Parse(dataBytes, flags=0):
+        if flags & FLAG_BINARY:
+            return Packet(decodeBinary(dataBytes), True)
+
+        data = json.loads(str(dataBytes, 'utf8'))
         return Packet(data)
 
 class Client:
@@ -32,13 +53,29 @@ class Client:
     ERROR_INVALID_REQUEST = 2
     ERROR_INVALID_BODY = 4
     ERROR_DATABASE = 8
-
-    def __init__(self, socket, addr, server, blockSize):
+    ERROR_BUSY = 16
+    ERROR_DEADLINE = 32
+    ERROR_UNKNOWN_MODEL = 64
+
+    IDLE_CLOSE = {
+        'errno': 0,
+        'closed': True,
+        'reason': 'Idle timeout.'
+    }
+    SHUTDOWN_CLOSE = {
+        'errno': 0,
+        'closed': True,
+        'reason': 'Server shutting down.'
+    }
+
+    def __init__(self, socket, addr, server, blockSize, idleTimeout=30, maxFrameSize=MAX_BODY_SIZE):
         self.server = server
         self.socket = socket
         self.addr = addr
         self.id = None
         self.blockSize = blockSize
+        self.idleTimeout = idleTimeout
+        self.framed = FramedSocket(socket, maxFrameSize, blockSize)
     
     def awaitPacket(self):
         """Recieve a packet from the client.
@@ -47,44 +84,32 @@ class Client:
             Packet -- Packet recieved.
         """
         try:
-            chunks = []
-            nread = 0
-            
-            # get packet size
-            sized = self.socket.recv(4)
-            size = unpack('<I', sized)[0]
-
-            self.server.log.debug("packet size: " + str(size))
-            self.server.log.debug("packet size bytes: " + str(sized))
-
-            # read the packet contents
-            while nread < size:
-                bytesLeft = size - nread
-                chunk = self.socket.recv(min(bytesLeft, self.blockSize))
-
-                if chunk == b'':
-                    self.server.log.error('Connection to client %d is interrupted while recieving.' % (self.id))
-                    return None
-                
-                nread += len(chunk)
-                chunks.append(chunk)
-            
-            # parse the packet data
-            dataBytes = b''.join(chunks)
-            self.server.log.debug("recv bytes: " + str(dataBytes))
-            packet = Packet.Parse(dataBytes)
+            start = time.perf_counter()
+            frame = self.framed.recvFrame()
+            if frame is None:
+                self.server.log.debug('Client %s closed the connection.' % (str(self.id)))
+                return None
 
-            return packet
+            (flags, body) = frame
+            self.server.metrics.observe('receive', time.perf_counter() - start)
+            self.server.log.debug("packet size: " + str(len(body)))
+
+            # parse the packet data before the buffer is reused
+            return Packet.Parse(body, flags)
 
         except Exception as e:
             self.server.log.error('Recv failed: ' + str(e), stack_info=e)
             return None
     
-    def sendError(self, errno):
-        """Send a error packet back to the client
+    @staticmethod
+    def makeError(errno):
+        """Make the body of an error response.
         
         Arguments:
             errno {int} -- Error number.
+        
+        Returns:
+            dict -- Error response data.
         """
         errStr = ''
 
@@ -94,15 +119,27 @@ class Client:
             errStr = 'Invalid body.'
         elif errno == Client.ERROR_DATABASE:
             errStr = 'Database error.'
+        elif errno == Client.ERROR_BUSY:
+            errStr = 'Server busy, try again later.'
+        elif errno == Client.ERROR_DEADLINE:
+            errStr = 'Deadline exceeded.'
+        elif errno == Client.ERROR_UNKNOWN_MODEL:
+            errStr = 'Unknown model.'
         else:
             errStr = 'Unknonw error.'
 
-        packet = Packet({
+        return {
             'error': errStr,
-            'errno': Client.ERROR_INVALID_REQUEST
-        })
+            'errno': errno
+        }
 
-        self.sendPacket(packet)
+    def sendError(self, errno):
+        """Send a error packet back to the client
+        
+        Arguments:
+            errno {int} -- Error number.
+        """
+        self.sendPacket(Packet(Client.makeError(errno)))
     
     def sendPacket(self, packet):
         """Send a packet to the client.
@@ -111,89 +148,373 @@ class Client:
             packet {Packet} -- Packet object containing the data.
         """
         try:
-            data = packet.makePacket()
-            totalBytes = len(data)
-
-            nsent = 0
-            while nsent < totalBytes:
-                sent = self.socket.send(data[nsent:])
+            self.server.countResponse(packet.data)
 
-                if sent == 0:
-                    self.server.log.error('Connection to client %d is interrupted while sending.' % (self.id))
-                    return False
-                
-                nsent += sent
-            
+            with self.server.metrics.timer('serialize'):
+                data = packet.makePacket()
+            with self.server.metrics.timer('send'):
+                self.framed.send(data)
             return True
         except Exception as e:
             self.server.log.error('Send failed: %s' % (str(e)), stack_info=e)
             return False
 
-    def _client_handle_thread(self):
+    @staticmethod
+    def _isLoginList(logins):
+        return type(logins) is list and all(type(login) is str for login in logins)
+
+    def _handlePredict(self, data):
+        if not Client._isLoginList(data.get('logins')) or type(data.get('model', '')) is not str:
+            self.server.log.debug('Client %d sent an invalid body.' % (self.id))
+            return Client.makeError(Client.ERROR_INVALID_BODY)
+
+        # the model is picked once, so a reload during the request doesn't mix models
+        model = self.server.registry.get(data.get('model'))
+        if model is None:
+            self.server.log.debug('Client %d requested unknown model %s.' % (self.id, data['model']))
+            return Client.makeError(Client.ERROR_UNKNOWN_MODEL)
+
+        return self._predictLogins(data['logins'], model)
+
+    def _predictLogins(self, logins, model):
+        result = {
+            'errno': 0,
+            'model': model.name,
+            'predictions': []
+        }
+
+        if len(logins) > 0:
+            # make a prediction on all logins at once
+            predictions = None
+            try:
+                predictions = self.server.classifyMany(logins, model)
+            except (ConnectionRefusedError, DatabaseException):
+                return Client.makeError(Client.ERROR_DATABASE)
+
+            if predictions is None:
+                return Client.makeError(Client.ERROR_UNKNOWN)
+
+            for login in logins:
+                prediction = predictions.get(login)
+                pred_result = {}
+
+                if prediction is None:
+                    self.server.log.debug('Prediction failed; check error log msg.')
+                    pred_result = {
+                        'login': login,
+                        'success': False,
+                        'error': 'Player '+login+' not found.'
+                    }
+                else:
+                    pred_result = {
+                        'login': login,
+                        'success': True,
+                        'experienced': float(prediction[0]),
+                        'beginner': float(prediction[1]),
+                    }
+                
+                result['predictions'].append(pred_result)
+        
+            if len(result['predictions']) == 0:
+                return Client.makeError(Client.ERROR_UNKNOWN)
+
+        return result
+
+    def _handleInvalidate(self, data):
+        if not Client._isLoginList(data.get('logins')):
+            self.server.log.debug('Client %d sent an invalid body.' % (self.id))
+            return Client.makeError(Client.ERROR_INVALID_BODY)
+
+        return {
+            'errno': 0,
+            'invalidated': self.server.invalidate(data['logins'])
+        }
+
+    def _handleReload(self, data):
+        if type(data.get('model', '')) is not str:
+            self.server.log.debug('Client %d sent an invalid body.' % (self.id))
+            return Client.makeError(Client.ERROR_INVALID_BODY)
+
+        names = None
+        if 'model' in data:
+            if self.server.registry.get(data['model']) is None:
+                return Client.makeError(Client.ERROR_UNKNOWN_MODEL)
+            names = [data['model']]
+
+        # loading and warming up takes a while, the current models keep serving meanwhile
+        self.server.registry.reloadAsync(names)
+
+        return {
+            'errno': 0,
+            'reloading': names if names is not None else sorted(self.server.registry.files)
+        }
+
+    def handleRequest(self, data):
+        """Handle a single request.
+        
+        Arguments:
+            data {dict} -- Request data.
+        
+        Returns:
+            dict -- Response data.
+        """
+        # check if request option exists
+        if type(data) is not dict or 'request' not in data:
+            self.server.log.debug('Client %d sent an invalid request.' % (self.id))
+            return Client.makeError(Client.ERROR_INVALID_REQUEST)
+
+        # check for valid requests
+        if data['request'] == 'predict':
+            return self._handlePredict(data)
+        elif data['request'] == 'invalidate':
+            return self._handleInvalidate(data)
+        elif data['request'] == 'reload':
+            return self._handleReload(data)
+        elif data['request'] == 'stats':
+            return {
+                'errno': 0,
+                'stats': self.server.getStats()
+            }
+
+        self.server.log.debug('Client %d sent an invalid request.' % (self.id))
+        return Client.makeError(Client.ERROR_INVALID_REQUEST)
+
+    def _awaitReadable(self):
+        # the server's drain wakeup becomes readable when it shuts down
+        readable, _, _ = select.select([self.socket, self.server.drainWakeup], [], [], self.idleTimeout)
+        return readable
+
+    @staticmethod
+    def _isStream(data):
+        return type(data) is dict and data.get('request') == 'predict' and data.get('stream') is True and type(data.get('logins')) is list
+
+    @staticmethod
+    def _isKeepalive(data):
+        # requests with keepalive set leave the connection open for more requests
+        return type(data) is dict and data.get('keepalive', False) is True
+
+    def _openStream(self, data):
+        if not Client._isLoginList(data['logins']) or type(data.get('model', '')) is not str:
+            self.server.log.debug('Client %d sent an invalid body.' % (self.id))
+            return (Client.makeError(Client.ERROR_INVALID_BODY), None)
+
+        # one model for all chunks, like a request that isn't streamed
+        model = self.server.registry.get(data.get('model'))
+        if model is None:
+            self.server.log.debug('Client %d requested unknown model %s.' % (self.id, data['model']))
+            return (Client.makeError(Client.ERROR_UNKNOWN_MODEL), None)
+
+        return (None, model)
+
+    def _streamChunks(self, logins):
+        chunkSize = self.server.streamChunkSize
+        return [logins[i:i + chunkSize] for i in range(0, len(logins), chunkSize)]
+
+    @staticmethod
+    def _countChunk(summary, errors, chunk, result):
+        # returns the partial response to send, None if the chunk failed as a whole
+        if result['errno'] > 0:
+            summary['failed'] += len(chunk)
+            errors.append({
+                'logins': chunk,
+                'errno': result['errno'],
+                'error': result['error']
+            })
+            return None
+
+        for prediction in result['predictions']:
+            if prediction['success']:
+                summary['succeeded'] += 1
+            else:
+                summary['failed'] += 1
+
+        result['partial'] = True
+        return result
+
+    @staticmethod
+    def _streamDone(summary, errors):
+        return {
+            'errno': 0,
+            'done': True,
+            'summary': summary,
+            'errors': errors
+        }
+
+    def _streamPredict(self, data):
+        # classify chunks of the logins concurrently and yield each chunk as soon as it is done
+        (error, model) = self._openStream(data)
+        if error is not None:
+            yield error
+            return
+
+        futures = {}
+        for chunk in self._streamChunks(data['logins']):
+            futures[self.server.streamExecutor.submit(self._predictLogins, chunk, model)] = chunk
+
+        summary = {
+            'total': len(data['logins']),
+            'succeeded': 0,
+            'failed': 0
+        }
+        errors = []
+
+        for future in as_completed(futures):
+            result = Client._countChunk(summary, errors, futures[future], future.result())
+            if result is not None:
+                yield result
+
+        yield Client._streamDone(summary, errors)
+
+    def _runStream(self, data, stream):
+        # runs as one scheduled request, so streams count against the worker pool and its queue
         try:
-            # handle client ...
-            packet = self.awaitPacket()
+            for response in self._streamPredict(data):
+                stream.put(response)
+        except Exception as e:
+            self.server.log.error('Streamed predict failed: ' + str(e), stack_info=e)
+            stream.put(Client.makeError(Client.ERROR_UNKNOWN))
+        finally:
+            stream.put(None)
 
-            if packet is None:
-                self.server.log.debug('Packet is null, aborting ...')
-                return
+    @staticmethod
+    def _streamRejected(stream, job):
+        # the stream was not run, because its deadline passed or the server is stopping
+        try:
+            e = job.exception()
+        except Exception:
+            e = None
+
+        if e is not None:
+            stream.put(Client.makeError(Client.ERROR_DEADLINE if isinstance(e, DeadlineExceededException) else Client.ERROR_BUSY))
+            stream.put(None)
 
-            # check if request option exists
-            if 'request' not in packet.data:
-                self.sendError(Client.ERROR_INVALID_REQUEST)
-                self.server.log.debug('Client %d sent an invalid request.' % (self.id))
+    @staticmethod
+    def _iterStream(stream):
+        while True:
+            response = stream.get()
+            if response is None:
                 return
+            yield response
+
+    @staticmethod
+    def _withId(responses, requestId):
+        for response in responses:
+            response['id'] = requestId
+            yield response
+
+    def respond(self, data):
+        """Handle a request packet, including connection control fields.
+        
+        Arguments:
+            data {dict} -- Request data.
+        
+        Returns:
+            tuple -- List of response data to send in order, and whether the connection should be kept open.
+        """
+        keepalive = Client._isKeepalive(data)
+
+        if type(data) is dict and data.get('request') == 'close':
+            responses = [{
+                'errno': 0,
+                'closed': True,
+                'reason': 'Closed by client.'
+            }]
+            keepalive = False
+        else:
+            responses = [self.handleRequest(data)]
+
+        # echo the request id so pipelined responses can be matched
+        if type(data) is dict and 'id' in data:
+            for response in responses:
+                response['id'] = data['id']
+
+        return (responses, keepalive)
+
+    def submitRequest(self, data):
+        """Queue a request packet on the server's worker pool.
+        
+        Arguments:
+            data {dict} -- Request data.
+        
+        Raises:
+            ServerBusyException -- The server's work queue is full.
+        
+        Returns:
+            Future -- Future resolving to the result of respond(), or to a generator of the responses for streamed requests.
+        """
+        deadline = self.server.getDeadline(data)
+
+        if not Client._isStream(data):
+            return self.server.scheduler.submit(self.respond, data, deadline=deadline)
 
-            # check for valid requests
-            if packet.data['request'] == 'predict':
-                if 'logins' not in packet.data or type(packet.data['logins']) is not list:
-                    self.sendError(Client.ERROR_INVALID_BODY)
-                    self.server.log.debug('Client %d sent an invalid body.' % (self.id))
+        # the stream is one scheduled request, its responses are handed over as they are ready
+        stream = Queue()
+        job = self.server.scheduler.submit(self._runStream, data, stream, deadline=deadline)
+        job.add_done_callback(lambda job: Client._streamRejected(stream, job))
+
+        responses = Client._iterStream(stream)
+        if 'id' in data:
+            responses = Client._withId(responses, data['id'])
+
+        future = Future()
+        future.set_result((responses, Client._isKeepalive(data)))
+        return future
+
+    def reject(self, data, errno):
+        """Answer a request that was not run.
+        
+        Arguments:
+            data {dict} -- Request data.
+            errno {int} -- Error number.
+        
+        Returns:
+            tuple -- Iterable of response data and whether the connection should be kept open.
+        """
+        response = Client.makeError(errno)
+        keepalive = Client._isKeepalive(data)
+
+        if type(data) is dict and 'id' in data:
+            response['id'] = data['id']
+
+        return ([response], keepalive)
+
+    def _client_handle_thread(self):
+        try:
+            while True:
+                # handle client ...
+                packet = self.awaitPacket()
+
+                if packet is None:
+                    self.server.log.debug('Packet is null, aborting ...')
                     return
 
-                result = {
-                    'errno': 0,
-                    'predictions': []
-                }
-
-                if len(packet.data['logins']) > 0:
-                # make a prediction on each login
-                    for login in packet.data['logins']:
-                        prediction = None
-                        try:
-                            prediction = self.server.classify(login)
-                        except ConnectionRefusedError as e:
-                            self.sendError(Client.ERROR_DATABASE)
-                            return
-
-                        pred_result = {}
-
-                        if prediction is None:
-                            self.server.log.debug('Prediction failed; check error log msg.')
-                            pred_result = {
-                                'login': login,
-                                'success': False,
-                                'error': 'Player '+login+' not found.'
-                            }
-                        else:
-                            pred_result = {
-                                'login': login,
-                                'success': True,
-                                'experienced': float(prediction[0][0]),
-                                'beginner': float(prediction[0][1]),
-                            }
-                        
-                        result['predictions'].append(pred_result)
-                
-                    if len(result['predictions']) == 0:
-                        self.sendError(Client.ERROR_UNKNOWN)
+                try:
+                    (responses, keepalive) = self.submitRequest(packet.data).result()
+                except ServerBusyException:
+                    self.server.log.warn('Work queue full, client %d is told to back off.' % (self.id))
+                    (responses, keepalive) = self.reject(packet.data, Client.ERROR_BUSY)
+                except DeadlineExceededException:
+                    (responses, keepalive) = self.reject(packet.data, Client.ERROR_DEADLINE)
+
+                # answer in the encoding the client used
+                for response in responses:
+                    if not self.sendPacket(Packet(response, packet.binary)):
                         return
-                
-                resultPacket = Packet(result)
-                self.sendPacket(resultPacket)
-            else:
-                self.sendError(Client.ERROR_INVALID_REQUEST)
-                self.server.log.debug('Client %d sent an invalid request.' % (self.id))
+
+                if not keepalive:
+                    return
+
+                readable = self._awaitReadable()
+                if self.socket in readable:
+                    continue
+
+                if self.server.drainWakeup in readable:
+                    self.server.log.debug('Server shutting down, closing idle client %d.' % (self.id))
+                    self.sendPacket(Packet(Client.SHUTDOWN_CLOSE))
+                else:
+                    self.server.log.debug('Client %d idle for %d seconds, closing.' % (self.id, self.idleTimeout))
+                    self.sendPacket(Packet(Client.IDLE_CLOSE))
+                return
         finally:
             self.server.log.debug('Client %d finished.' % (self.id))
             self.socket.close()
@@ -206,32 +527,219 @@ class Client:
         t.start()
 
 class PredictionServer:
-    def __init__(self, config, log, model, args):
+    def __init__(self, config, log, registry, args, listenSocket=None):
         self.config = config
         self.log = log
-        self.model = model
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.registry = registry
+        # a listening socket is passed in by the pre-fork master, otherwise serve() binds one
+        self.socket = listenSocket
         self.clientId = 0
         self.clientLock = RLock()
+        self.clientsFree = Condition(self.clientLock)
         self.clients = {}
         self.db = EvoSCDB(config, log, args.dt_values.split(','))
         self.args = args
-        self.classifier = Classifier(self.db, model, args.dt_values.split(','))
-        self.classifierLock = RLock()
+        self.metrics = Metrics()
+        # only fetches the datapoints, the models come from the registry
+        self.classifier = Classifier(self.db, None, args.dt_values.split(','), self.metrics)
+        self.dispatcher = BatchDispatcher(
+            self.predict,
+            log,
+            int(config['Server'].get('MaxBatchSize', '64')),
+            int(config['Server'].get('MaxBatchDelayMs', '5'))/1000
+        )
+        self.scheduler = RequestScheduler(
+            log,
+            int(config['Server'].get('Workers', '8')),
+            int(config['Server'].get('QueueSize', '64')),
+            self.metrics
+        )
+        self.defaultDeadline = float(config['Server'].get('DefaultDeadlineMs', '0'))/1000
+        self.streamChunkSize = int(config['Server'].get('StreamChunkSize', '50'))
+        self.streamExecutor = ThreadPoolExecutor(max_workers=int(config['Server'].get('StreamWorkers', '4')))
+        self.cache = None
+
+        self.metricsServer = None
+        if config.has_section('Metrics') and config['Metrics'].get('Enabled', 'false').lower() == 'true':
+            self.metricsServer = MetricsServer(config, log, self)
+
+        self.featureStore = None
+        if config.has_section('Snapshot') and config['Snapshot'].get('Enabled', 'false').lower() == 'true':
+            self.featureStore = FeatureStore(config, log, self.db, self.classifier.schema)
+
+        if config.has_section('Cache') and config['Cache'].get('Enabled', 'false').lower() == 'true':
+            self.cache = PredictionCache(
+                int(config['Cache'].get('MaxEntries', '10000')),
+                float(config['Cache'].get('TTL', '300'))
+            )
+
+    @staticmethod
+    def makeListenSocket(config, log):
+        """Bind and listen on the configured server address.
+        
+        Arguments:
+            config {ConfigParser} -- Configuration with a [Server] section.
+            log {Logger} -- Logger to use.
+        
+        Returns:
+            socket -- Listening socket.
+        """
+        address = config['Server']['ListenAddress']
+        port = int(config['Server']['ListenPort'])
+        listenSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # allow restarting right after a shutdown, while old connections are in TIME_WAIT
+        listenSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+        log.debug('Binding socket to: %s:%d' % (address, port))
+        listenSocket.bind((address, port))
+
+        log.debug('Start listen ...')
+        listenSocket.listen(int(config['Server']['Backlog']))
+
+        return listenSocket
+
+    def predict(self, points, model):
+        with self.metrics.timer('inference'):
+            return model.predict(points)
+
+    def classifyMany(self, logins, model=None):
+        if model is None:
+            model = self.registry.get()
 
-    def classify(self, login):
         try:
-            self.classifierLock.acquire()
-            prediction = self.classifier.classify(login)
-            return prediction
-        except Exception as e:
-            self.log.error('Failed to classify player: ' + str(e), stack_info=e)
-            return None
-        except ConnectionRefusedError as e:
+            results = {}
+            missing = []
+
+            for login in logins:
+                if login in results:
+                    continue
+
+                results[login] = None if self.cache is None else self.cache.get(model.modelId, login)
+                if results[login] is None:
+                    missing.append(login)
+
+            if len(missing) == 0:
+                return results
+
+            points = {}
+            if self.featureStore is not None:
+                points = self.featureStore.lookup(missing)
+                missing = [login for login in missing if login not in points]
+
+            # stats are fetched in parallel by the client threads through the db pool
+            if len(missing) > 0:
+                points.update(self.classifier.getFeatures(missing))
+
+            found = [login for login in points if points[login] is not None]
+
+            if len(found) == 0:
+                return results
+
+            if self.dispatcher.thread is None:
+                predictions = self.predict([points[login] for login in found], model)
+            else:
+                # inference is batched together with requests for the same model from other clients
+                predictions = self.dispatcher.submit([points[login] for login in found], model).wait()
+
+            # a model that is new to the cache was loaded by a reload, drop what the replaced models cached
+            if self.cache is not None and not self.cache.hasModel(model.modelId):
+                self.cache.retainModels(self.registry.getModelIds())
+
+            for i, login in enumerate(found):
+                results[login] = [float(predictions[i][0]), float(predictions[i][1])]
+
+                if self.cache is not None:
+                    self.cache.put(model.modelId, login, results[login])
+
+            return results
+        except (ConnectionRefusedError, DatabaseException) as e:
             self.log.error('Failed to connect to database: ' + str(e), stack_info=e)
             raise e
-        finally:
-            self.classifierLock.release()
+        except Exception as e:
+            self.log.error('Failed to classify players: ' + str(e), stack_info=e)
+            return None
+
+    def getDeadline(self, data):
+        """Deadline of a request, counted from now.
+        
+        Arguments:
+            data {dict} -- Request data, may hold the client's budget in deadline_ms.
+        
+        Returns:
+            float -- time.monotonic() value after which the request is dropped, None for no deadline.
+        """
+        budget = self.defaultDeadline
+
+        if type(data) is dict and type(data.get('deadline_ms')) in (int, float) and data['deadline_ms'] > 0:
+            budget = data['deadline_ms']/1000
+
+        if budget <= 0:
+            return None
+
+        return time.monotonic() + budget
+
+    def invalidate(self, logins):
+        """Remove players from the prediction cache, and read their stats from
+        the database instead of the snapshot until it is refreshed.
+        
+        Arguments:
+            logins {list} -- Login names of players.
+        
+        Returns:
+            int -- Number of removed cache entries.
+        """
+        if self.featureStore is not None:
+            self.featureStore.invalidate(logins)
+
+        if self.cache is None:
+            return 0
+
+        removed = self.cache.invalidate(logins)
+        self.log.debug('Invalidated %d cached predictions.' % (removed))
+        return removed
+
+    def getStats(self):
+        """Get statistics of the server's cache and feature snapshot.
+        
+        Returns:
+            dict -- Server statistics.
+        """
+        return {
+            'cache': None if self.cache is None else self.cache.getStats(),
+            'snapshot': None if self.featureStore is None else self.featureStore.getStats(),
+            'scheduler': self.scheduler.getStats(),
+            'clients': self.getNumClients(),
+            'models': self.registry.getStats(),
+            'metrics': self.metrics.getStats()
+        }
+
+    def getGauges(self):
+        """Get the current values exposed next to the metrics.
+        
+        Returns:
+            dict -- Gauge values by name, None for values that are not available.
+        """
+        cache = None if self.cache is None else self.cache.getStats()
+        snapshot = None if self.featureStore is None else self.featureStore.getStats()
+
+        return {
+            'queue_depth': self.scheduler.queue.qsize(),
+            'batch_queue_depth': self.dispatcher.queue.qsize(),
+            'connections': self.getNumClients(),
+            'cache_hit_rate': None if cache is None else cache['hit_rate'],
+            'snapshot_hit_rate': None if snapshot is None else snapshot['hit_rate']
+        }
+
+    def countResponse(self, data):
+        """Count a response sent to a client.
+        
+        Arguments:
+            data {dict} -- Response data.
+        """
+        self.metrics.increment('responses')
+
+        if type(data) is dict and data.get('errno', 0) > 0:
+            self.metrics.countError(data['errno'])
 
     def addClient(self, client):
         try:
@@ -239,6 +747,7 @@ class PredictionServer:
 
             clientId = self.clientId
             self.clientId += 1
+            self.clients[clientId] = client
 
             return clientId
         finally:
@@ -250,6 +759,7 @@ class PredictionServer:
 
             if clientId in self.clients:
                 del self.clients[clientId]
+                self.clientsFree.notify_all()
         finally:
             self.clientLock.release()
     
@@ -260,59 +770,141 @@ class PredictionServer:
         finally:
             self.clientLock.release()
     
+    def waitForSlot(self, maxClients):
+        """Block until fewer than maxClients clients are connected.
+        
+        Arguments:
+            maxClients {int} -- Max number of connected clients.
+        """
+        with self.clientsFree:
+            if len(self.clients) >= maxClients:
+                self.log.warn('Max clients exceeded, waiting for a client to finish ...')
+
+            while len(self.clients) >= maxClients:
+                self.clientsFree.wait()
+
+    def drain(self, timeout):
+        """Wait for the connected clients to finish.
+        
+        Arguments:
+            timeout {float} -- Max seconds to wait.
+        
+        Returns:
+            bool -- True if all clients finished in time.
+        """
+        deadline = time.monotonic() + timeout
+
+        # keepalive clients waiting for their next request are told to close
+        self.drainNotify.send(b'\0')
+
+        with self.clientsFree:
+            if len(self.clients) > 0:
+                self.log.info('Waiting up to %d seconds for %d clients to finish ...' % (timeout, len(self.clients)))
+
+            while len(self.clients) > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+
+                self.clientsFree.wait(remaining)
+
+        return True
+
+    def rejectBusy(self, csocket):
+        # tell the client to back off instead of just dropping the connection
+        try:
+            response = Client.makeError(Client.ERROR_BUSY)
+            self.countResponse(response)
+            csocket.sendall(Packet(response).makePacket())
+        except Exception as e:
+            self.log.debug('Failed to send busy response: ' + str(e))
+        finally:
+            csocket.close()
+
     def serve(self):
-        address = self.config['Server']['ListenAddress']
-        port = int(self.config['Server']['ListenPort'])
-        rejectOnMaxClients = self.config['Server']['RejectOnMaxClients']
-        maxClientsRetryInterval = int(self.config['Server']['MaxClientsRetryInterval'])
+        rejectOnMaxClients = self.config['Server']['RejectOnMaxClients'].lower() == 'true'
         maxClients = int(self.config['Server']['MaxClients'])
         dataBlockSize = int(self.config['Server']['DataBlockSize'])
+        idleTimeout = float(self.config['Server'].get('IdleTimeout', '30'))
+        maxFrameSize = int(self.config['Server'].get('MaxFrameSize', '1048576'))
+        drainTimeout = float(self.config['Server'].get('DrainTimeout', '10'))
 
         # setup socket
-        self.log.debug('Binding socket to: %s:%d' % (address, port))
-        self.socket.bind((address, port))
+        if self.socket is None:
+            self.socket = PredictionServer.makeListenSocket(self.config, self.log)
+        (self.drainNotify, self.drainWakeup) = socket.socketpair()
 
-        self.log.debug('Start listen ...')
-        self.socket.listen(int(self.config['Server']['Backlog']))
+        self.log.debug('Starting batch dispatcher ...')
+        self.dispatcher.start()
+        self.scheduler.start()
+        self.registry.start()
+
+        if self.featureStore is not None:
+            self.featureStore.start()
+
+        if self.metricsServer is not None:
+            self.metricsServer.start()
 
         self.log.debug('Waiting for connections ...')
 
         # wait and accept clients
         try:
             while True:
-                while self.getNumClients() >= maxClients and not rejectOnMaxClients:
-                    self.log.warn('Max clients exceeded, waiting %d milliseconds ...' % (maxClientsRetryInterval))
-                    time.sleep(maxClientsRetryInterval/1000)
+                if not rejectOnMaxClients:
+                    # pending connections wait in the backlog until a slot frees up
+                    self.waitForSlot(maxClients)
                 
                 # accept client
                 (csocket, caddress) = self.socket.accept()
+                accepted = time.perf_counter()
+                self.metrics.increment('connections')
                 self.log.debug('Accept client: %s' % (str(caddress)))
 
                 if rejectOnMaxClients and self.getNumClients() >= maxClients:
                     # reject client instead of waiting for available slots
                     self.log.warn('Max clients exceeded, rejecting client.')
-                    csocket.close()
+                    self.rejectBusy(csocket)
                     continue
                 
                 # handle client
-                client = Client(csocket, caddress, self, dataBlockSize)
+                client = Client(csocket, caddress, self, dataBlockSize, idleTimeout, maxFrameSize)
                 client.id = self.addClient(client)
                 self.log.debug('Handling client ...')
                 client.handleAsync()
-        except (KeyboardInterrupt, SystemExit):
-            self.log.info('KeyboardInterrupt, closing down ...')
+                self.metrics.observe('accept', time.perf_counter() - accepted)
+        except KeyboardInterrupt:
+            self.log.info('SIGINT, closing down ...')
+        except SystemExit:
+            # raised by _raiseExit, the SIGTERM handler
+            self.log.info('SIGTERM, closing down ...')
         except Exception as e:
             self.log.error('Error: ' + str(e), stack_info=e)
-        
+
+        # stop accepting and let requests in progress finish
+        self.socket.close()
+        self.drain(drainTimeout)
+
+        self.registry.stop()
+        self.scheduler.stop()
+        self.dispatcher.stop()
+        if self.featureStore is not None:
+            self.featureStore.stop()
+        if self.metricsServer is not None:
+            self.metricsServer.stop()
+        self.db.pool.close()
+
         # close all clients still connected
         self.log.debug('Closing all client connections ...')
-        for clientId in self.clients:
+        for clientId in list(self.clients):
             try:
                 self.clients[clientId].socket.close()
                 self.log.debug('Closed client with id %d' % (clientId))
             except Exception as e:
                 self.log.error('Failed closing client connection: ' + str(e), stack_info=e)
 
+        self.drainNotify.close()
+        self.drainWakeup.close()
+
 class CmdServer:
     def __init__(self, args, config, log):
         self.log = log
@@ -320,21 +912,57 @@ class CmdServer:
         self.config = config
         self.server = None
 
+    def makeServer(self, listenSocket=None):
+        """Load the model and create the prediction server.
+        
+        Arguments:
+            listenSocket {socket} -- Listening socket to serve on, None to bind one.
+        
+        Returns:
+            PredictionServer -- Server, None if the model can't be served.
+        """
+        # load, check and warm up all models
+        try:
+            registry = ModelRegistry(self.config, self.log, self.args.dt_values.split(','))
+        except FeatureSchemaException as e:
+            self.log.error('Invalid --dt-values: ' + str(e))
+            return None
+
+        if not registry.loadAll():
+            return None
+
+        # initialize server
+        if self.config['Server'].get('Engine', 'threaded').lower() == 'asyncio':
+            from begcla.asyncserver import AsyncPredictionServer
+            return AsyncPredictionServer(self.config, self.log, registry, self.args, listenSocket)
+
+        return PredictionServer(self.config, self.log, registry, self.args, listenSocket)
+
     def run(self):
-        modelfile = self.config['Classifier']['Model']
-        if not os.path.exists(modelfile):
-            self.log.error('Could not load model: %s' % (modelfile))
+        workers = getattr(self.args, 'workers', 1)
+
+        if workers > 1 and not hasattr(os, 'fork'):
+            self.log.error('Forking is not supported on this OS, continuing with a single process ...')
+            workers = 1
+
+        if workers > 1:
+            # each worker loads its own model after the fork
+            from begcla.prefork import PreforkMaster
+            self.log.info('Starting up prediction server with %d worker processes.' % (workers))
+            if not PreforkMaster(self.config, self.log, self.makeServer, workers).run():
+                sys.exit(1)
             return
 
-        # load and initialize model
-        from keras.models import load_model
-
-        self.log.debug('Loading model file %s' % (modelfile))
+        # the reason was logged by makeServer
+        self.server = self.makeServer()
+        if self.server is None:
+            sys.exit(1)
 
-        model = load_model(modelfile)
-        model._make_predict_function() # initialize model so that it is thread-safe
+        # stop accepting on SIGTERM and let the clients in progress finish
+        signal.signal(signal.SIGTERM, _raiseExit)
 
-        # initialize and start server
-        self.server = PredictionServer(self.config, self.log, model, self.args)
         self.log.info('Starting up prediction server.')
         self.server.serve()
+
+def _raiseExit(signum, frame):
+    raise SystemExit(0)
@@ -0,0 +1,251 @@
+import os
+import csv
+import json
+import time
+import shutil
+import tempfile
+import itertools
+import numpy as np
+from argparse import Namespace
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from begcla.dataset import loadRows
+from begcla.features import FeatureSchema, FeatureSchemaException
+from begcla.pipeline import expandShards, getFolds
+from begcla.commands.cmd_model import CmdModel, DEFAULT_OPTIONS
+
+# model options a sweep can vary, by their command line name
+SWEEP_OPTIONS = {
+    'batch-size': 'batch_size',
+    'epochs': 'epochs',
+    'out-layer-activation': 'outlayer_activation',
+    'inner-layers': 'inner_layers',
+    'in-layer-size': 'inlayer_size',
+    'in-layer-activation': 'inlayer_activation',
+    'optimizer': 'optimizer',
+    'loss': 'loss'
+}
+
+# state of a trial worker process, set up once by _initWorker
+_worker = {}
+
+def _initWorker(rowsFile, dataValues, folds, patience, backend, threads):
+    # cap the threads of each trial before tensorflow is loaded
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = '1'
+
+    try:
+        import tensorflow as tf
+        if hasattr(tf, 'config') and hasattr(tf.config, 'threading'):
+            tf.config.threading.set_intra_op_parallelism_threads(threads)
+            tf.config.threading.set_inter_op_parallelism_threads(1)
+    except ImportError:
+        pass
+
+    # all workers share the rows parsed by the main process
+    rows = np.load(rowsFile, mmap_mode='r')
+    schema = FeatureSchema(dataValues)
+
+    _worker['points'] = schema.fromRows(rows)
+    _worker['labels'] = rows[:, -1].astype(np.int64)
+    _worker['folds'] = getFolds(rows[:, 0], folds)
+    _worker['numFolds'] = folds
+    _worker['patience'] = patience
+    _worker['backend'] = backend
+
+def _measureLatency(model, inputSize, backend, runs=50):
+    # median time of classifying one datapoint, like a single-login predict request
+    if backend == 'numpy':
+        from begcla.inference import NumpyModel
+
+        (fd, tmpFile) = tempfile.mkstemp(suffix='.h5')
+        os.close(fd)
+        try:
+            model.save(tmpFile)
+            predictor = NumpyModel.load(tmpFile)
+        finally:
+            os.remove(tmpFile)
+
+        predict = predictor.predict
+    else:
+        predict = lambda x: model.predict(x, verbose=0)
+
+    point = np.zeros((1, inputSize), dtype=np.float32)
+    predict(point)
+
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        predict(point)
+        times.append(time.perf_counter() - start)
+
+    return float(np.median(times))
+
+def _runTrial(params):
+    import keras
+    from keras.callbacks import EarlyStopping
+
+    options = Namespace(**dict(DEFAULT_OPTIONS, **params))
+    points = _worker['points']
+    labels = keras.utils.to_categorical(_worker['labels'], num_classes=2)
+    folds = _worker['folds']
+
+    accuracies = []
+    epochs = []
+    model = None
+
+    for fold in range(_worker['numFolds']):
+        train = folds != fold
+        validation = folds == fold
+
+        model = CmdModel.buildModel(options, points.shape[1])
+        stopping = EarlyStopping(monitor='val_loss', patience=_worker['patience'], restore_best_weights=True)
+        history = model.fit(
+            points[train], labels[train],
+            epochs=int(options.epochs),
+            batch_size=int(options.batch_size),
+            validation_data=(points[validation], labels[validation]),
+            callbacks=[stopping],
+            verbose=0
+        )
+
+        # accuracy of the restored best weights
+        predictions = model.predict(points[validation], verbose=0)
+        accuracies.append(float(np.mean(np.argmax(predictions, axis=1) == _worker['labels'][validation])))
+        epochs.append(len(history.history['val_loss']))
+
+    return {
+        'accuracy': float(np.mean(accuracies)),
+        'accuracy_std': float(np.std(accuracies)),
+        'epochs': float(np.mean(epochs)),
+        'latency': _measureLatency(model, points.shape[1], _worker['backend'])
+    }
+
+class CmdSweep:
+    def __init__(self, args, config, log):
+        self.log = log
+        self.args = args
+        self.config = config
+
+    def _loadSpec(self):
+        with open(self.args.spec_file) as f:
+            spec = json.load(f)
+
+        params = spec.get('params', {})
+        unknown = [name for name in params if name not in SWEEP_OPTIONS]
+        if len(unknown) > 0:
+            raise ValueError('Unknown options in sweep spec: %s (supported: %s)' % (', '.join(unknown), ', '.join(sorted(SWEEP_OPTIONS))))
+
+        names = sorted(params)
+        for name in names:
+            if type(params[name]) is not list or len(params[name]) == 0:
+                raise ValueError("Option '%s' in sweep spec must be a non-empty list of values." % (name))
+
+        grid = [dict((SWEEP_OPTIONS[name], value) for (name, value) in zip(names, values)) for values in itertools.product(*[params[name] for name in names])]
+
+        search = spec.get('search', 'grid')
+        if search == 'random':
+            trials = int(spec.get('trials', 10))
+            if trials < len(grid):
+                random = np.random.RandomState(spec.get('seed'))
+                grid = [grid[i] for i in sorted(random.choice(len(grid), trials, replace=False))]
+        elif search != 'grid':
+            raise ValueError("Unknown search '%s' in sweep spec, use grid or random." % (search))
+
+        return grid
+
+    @staticmethod
+    def _formatCommand(params, args):
+        # the model command reproducing a candidate on the full dataset
+        options = dict(DEFAULT_OPTIONS, **params)
+        parts = ['python main.py model', '--dataset ' + ' '.join(args.dataset_file), '--dt-values ' + args.dt_values]
+
+        for (name, dest) in sorted(SWEEP_OPTIONS.items()):
+            if dest not in params:
+                continue
+            value = options[dest]
+            parts.append('--%s %s' % (name, ' '.join(value) if type(value) is list else str(value)))
+
+        return ' '.join(parts)
+
+    def _writeReport(self, results):
+        with open(self.args.report_file, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['rank', 'accuracy', 'accuracy_std', 'latency_ms', 'epochs_run'] + sorted(SWEEP_OPTIONS) + ['command', 'error'])
+
+            for (rank, (params, result)) in enumerate(results):
+                options = dict(DEFAULT_OPTIONS, **params)
+                values = [' '.join(v) if type(v) is list else v for v in [options[SWEEP_OPTIONS[name]] for name in sorted(SWEEP_OPTIONS)]]
+
+                if 'error' in result:
+                    writer.writerow(['', '', '', '', ''] + values + [CmdSweep._formatCommand(params, self.args), result['error']])
+                else:
+                    writer.writerow([rank + 1, round(result['accuracy'], 4), round(result['accuracy_std'], 4), round(result['latency']*1000, 3), round(result['epochs'], 1)] + values + [CmdSweep._formatCommand(params, self.args), ''])
+
+    def run(self):
+        shards = expandShards(self.args.dataset_file)
+        missing = [shard for shard in shards if not os.path.exists(shard)]
+        if len(missing) > 0:
+            print("[-] The dataset file '%s' can't be found." % (missing[0]))
+            return
+
+        if self.args.folds < 2:
+            print("[-] Cross-validation needs at least 2 folds.")
+            return
+
+        try:
+            trials = self._loadSpec()
+            schema = FeatureSchema(self.args.dt_values.split(','))
+        except (OSError, ValueError, FeatureSchemaException) as e:
+            print("[-] " + str(e))
+            return
+
+        print("[+] Dataset: " + ', '.join(shards))
+        print("[+] Datapoint values: " + str(schema))
+        print("[+] Trials: %d, %d-fold cross-validation" % (len(trials), self.args.folds))
+        print("[+] Workers: %d processes, %d threads each" % (self.args.workers, self.args.threads))
+        print("[+] Report: " + str(self.args.report_file))
+
+        cacheDir = None
+        if not self.args.no_cache:
+            cacheDir = os.path.join(os.path.dirname(os.path.abspath(shards[0])), '.cache')
+
+        # parse the dataset once, the workers memory-map it
+        rows = np.concatenate([loadRows(shard, self.log, cacheDir) for shard in shards])
+        print("[+] Loaded %d datapoints." % (len(rows)))
+
+        tmpDir = tempfile.mkdtemp(prefix='begcla-sweep-')
+        rowsFile = os.path.join(tmpDir, 'rows.npy')
+        np.save(rowsFile, rows)
+        del rows
+
+        results = []
+        try:
+            with ProcessPoolExecutor(
+                max_workers=self.args.workers,
+                initializer=_initWorker,
+                initargs=(rowsFile, schema.names, self.args.folds, self.args.patience, self.args.backend, self.args.threads)
+            ) as executor:
+                futures = dict((executor.submit(_runTrial, params), params) for params in trials)
+
+                for future in as_completed(futures):
+                    params = futures[future]
+
+                    try:
+                        result = future.result()
+                        print("[+] Trial %d/%d: accuracy %.4f (+- %.4f), latency %.3f ms, %s" % (len(results) + 1, len(trials), result['accuracy'], result['accuracy_std'], result['latency']*1000, json.dumps(params)))
+                    except Exception as e:
+                        result = {'error': str(e)}
+                        print("[-] Trial %d/%d failed: %s, %s" % (len(results) + 1, len(trials), str(e), json.dumps(params)))
+
+                    results.append((params, result))
+        finally:
+            shutil.rmtree(tmpDir, ignore_errors=True)
+
+        # best accuracy first, faster candidates first on a tie, failed trials last
+        results.sort(key=lambda r: (1, 0, 0) if 'error' in r[1] else (0, -round(r[1]['accuracy'], 4), r[1]['latency']))
+        self._writeReport(results)
+
+        for (rank, (params, result)) in enumerate(results[:5]):
+            if 'error' not in result:
+                print("[+] #%d: accuracy %.4f, latency %.3f ms: %s" % (rank + 1, result['accuracy'], result['latency']*1000, CmdSweep._formatCommand(params, self.args)))
@@ -1,22 +1,152 @@
+import time
 import mysql.connector
+from contextlib import contextmanager
+from threading import Thread, Event
+from queue import Queue, Empty
 
-class EvoSCDB:
-    def __init__(self, config, log, datavalues):
+class DatabaseException(Exception):
+    pass
+
+class PooledConnection:
+    def __init__(self, conn):
+        self.conn = conn
+        self.lastUsed = time.time()
+
+class ConnectionPool:
+    def __init__(self, config, log, size=None):
+        """Fixed size pool of database connections that are health checked,
+        recycled when idle for too long and reconnected in the background.
+        
+        Arguments:
+            config {ConfigParser} -- Configuration, settings are read from the [Database] section.
+            log {Logger} -- Logger to use.
+            size {int} -- Number of connections, None for [Database] PoolSize.
+        """
         self.config = config
         self.log = log
-        self.datavalues = datavalues
+        self.size = size if size is not None else int(config['Database'].get('PoolSize', '4'))
+        self.timeout = float(config['Database'].get('PoolTimeout', '5'))
+        self.recycleTime = float(config['Database'].get('PoolRecycle', '3600'))
+        self.healthCheckInterval = float(config['Database'].get('PoolHealthCheckInterval', '30'))
+        self.idle = Queue()
+        self.stopEvent = Event()
 
         try:
-            self.db = mysql.connector.connect(
-                host=config['Database']['Host'],
-                port=int(config['Database']['Port']),
-                user=config['Database']['Username'],
-                passwd=config['Database']['Password'],
-                database=config['Database']['Database']
-            )
+            for i in range(self.size):
+                self.idle.put(PooledConnection(self._connect()))
         except Exception as e:
             log.error("Failed connecting to database.", stack_info=e)
             raise e
+
+        self.thread = Thread(target=self._maintenance_thread, daemon=True)
+        self.thread.start()
+
+    def _connect(self):
+        # without autocommit, a long-lived connection keeps reading the snapshot of its first query
+        return mysql.connector.connect(
+            host=self.config['Database']['Host'],
+            port=int(self.config['Database']['Port']),
+            user=self.config['Database']['Username'],
+            passwd=self.config['Database']['Password'],
+            database=self.config['Database']['Database'],
+            autocommit=True
+        )
+
+    def _close(self, slot):
+        try:
+            if slot.conn is not None:
+                slot.conn.close()
+        except Exception:
+            pass
+        
+        slot.conn = None
+
+    def _check(self, slot, ping):
+        """Make sure a pooled connection is usable, reconnecting it if needed.
+        
+        Arguments:
+            slot {PooledConnection} -- Pooled connection to check.
+            ping {bool} -- Whether to ping the server to verify the connection.
+        
+        Returns:
+            bool -- True if the connection is usable.
+        """
+        try:
+            if slot.conn is not None and time.time() - slot.lastUsed > self.recycleTime:
+                self.log.debug('Recycling idle database connection ...')
+                self._close(slot)
+
+            if slot.conn is not None and ping and not slot.conn.is_connected():
+                self.log.error('Database not connected, attempting reconnection ...')
+                self._close(slot)
+
+            if slot.conn is None:
+                slot.conn = self._connect()
+                slot.lastUsed = time.time()
+
+            return True
+        except Exception as e:
+            self.log.error('Database reconnection failed: ' + str(e))
+            self._close(slot)
+            return False
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection from the pool for the duration of a with block.
+        
+        Raises:
+            DatabaseException: If no working connection could be obtained.
+        """
+        try:
+            slot = self.idle.get(timeout=self.timeout)
+        except Empty:
+            raise DatabaseException('No database connection available.')
+
+        try:
+            if not self._check(slot, time.time() - slot.lastUsed > self.healthCheckInterval):
+                raise DatabaseException('Database connection failed.')
+
+            yield slot.conn
+            slot.lastUsed = time.time()
+        except Exception as e:
+            # force a health check the next time this connection is used
+            slot.lastUsed = 0
+            raise e
+        finally:
+            self.idle.put(slot)
+
+    def _maintenance_thread(self):
+        while not self.stopEvent.wait(self.healthCheckInterval):
+            # only check connections that are not in use right now
+            for i in range(self.idle.qsize()):
+                try:
+                    slot = self.idle.get_nowait()
+                except Empty:
+                    break
+
+                try:
+                    self._check(slot, True)
+                finally:
+                    self.idle.put(slot)
+
+    def close(self):
+        self.stopEvent.set()
+
+        for i in range(self.size):
+            try:
+                self._close(self.idle.get(timeout=self.timeout))
+            except Empty:
+                break
+
+class EvoSCDB:
+    # max number of logins/ids put into a single IN (...) clause
+    BULK_CHUNK_SIZE = 500
+
+    def __init__(self, config, log, datavalues, pool=None):
+        self.config = config
+        self.log = log
+        self.datavalues = datavalues
+        self.pool = pool if pool is not None else ConnectionPool(config, log)
     
     def getPlayerStats(self, login):
         """Get stats used in the classifier of the given player.
@@ -27,61 +157,151 @@ class EvoSCDB:
         Returns:
             dict -- Stats of player.
         """
+        stats = self.getPlayerStatsBulk([login])
+
+        if stats is None:
+            return None
+
+        return stats[login]
+
+    def _statsQuery(self, where):
+        columns = [
+            'players.Login AS login',
+            'players.id AS id',
+            'stats.Visits AS visits',
+            'stats.Playtime AS play_time',
+            'stats.Finishes AS finishes',
+            'stats.Locals AS locals',
+            'stats.Wins AS wins',
+            'stats.Score AS score',
+            'stats.`Rank` AS `rank`'
+        ]
+
+        # derived features are aggregated by the database, only when needed
+        if 'record_rank_avg' in self.datavalues:
+            columns.append('COALESCE((SELECT AVG(lr.`Rank`) FROM `local-records` lr WHERE lr.Player=players.id), 0) AS record_rank_avg')
+        else:
+            columns.append('0 AS record_rank_avg')
+
+        if 'num_pbs' in self.datavalues:
+            columns.append('(SELECT COUNT(*) FROM pbs WHERE pbs.player_id=players.id) AS num_pbs')
+        else:
+            columns.append('0 AS num_pbs')
 
-        if not self.db.is_connected():
-            self.log.error('Database not connected, attempting reconnection ...')
-            self.db.reconnect()
+        return 'SELECT %s FROM players INNER JOIN stats ON players.id=stats.Player WHERE %s' % (', '.join(columns), where)
+
+    def getPlayerStatsBulk(self, logins):
+        """Get stats used in the classifier of several players at once.
+        
+        Arguments:
+            logins {list} -- Login names of players.
+        
+        Returns:
+            dict -- Stats of each player keyed by login, None for players that were not found.
+        """
+
+        unique = list(dict.fromkeys(logins))
 
         try:
-            self.log.debug("Getting stats of player '%s'" % (login))
-
-            cursor = self.db.cursor()
-
-            # get stats
-            cursor.execute('SELECT * FROM players INNER JOIN stats ON players.id=stats.Player WHERE players.Login=%s LIMIT 1', (login,))
-            statsRes = cursor.fetchall()
-
-            if len(statsRes) == 0:
-                return None
-
-            playerId = statsRes[0][0]
-
-            self.log.debug("Got stats of '%s'" % (login))
-
-            # get local records
-            rankAvg = 0
-            if 'record_rank_avg' in self.datavalues:
-                cursor.execute('SELECT Rank FROM `local-records` where Player=%s', (playerId,))
-                localRecords = cursor.fetchall()
-                if len(localRecords) > 0:
-                    for rec in localRecords:
-                        rankAvg += rec[0]
-                    rankAvg /= len(localRecords)
-                
-                self.log.debug("Got local-records avg of '%s'" % (login))
-
-            # get pbs
-            npbs = 0
-            if 'num_pbs' in self.datavalues:
-                cursor.execute('SELECT count(*) FROM pbs where player_id=%s', (playerId,))
-                pbs = cursor.fetchall()
-                npbs = len(pbs[0])
-                self.log.debug("Got pb count of '%s' count: %d" % (login, npbs))
-
-            return {
-                'id': playerId,
-                'visits': statsRes[0][12],
-                'play_time': statsRes[0][13],
-                'finishes': statsRes[0][14],
-                'locals': statsRes[0][15],
-                'wins': statsRes[0][17],
-                'score': statsRes[0][19],
-                'rank': statsRes[0][20],
-                'record_rank_avg': rankAvg,
-                'num_pbs': npbs
-            }
+            self.log.debug("Getting stats of %d players" % (len(unique)))
+            found = {}
+
+            with self.pool.connection() as db:
+                cursor = db.cursor(dictionary=True)
+
+                for i in range(0, len(unique), EvoSCDB.BULK_CHUNK_SIZE):
+                    chunk = unique[i:i + EvoSCDB.BULK_CHUNK_SIZE]
+                    cursor.execute(self._statsQuery('players.Login IN (%s)' % (','.join(['%s'] * len(chunk)))), tuple(chunk))
+
+                    for player in cursor.fetchall():
+                        player['record_rank_avg'] = float(player['record_rank_avg'])
+                        # logins are compared case-insensitively by the database
+                        found[player['login'].lower()] = player
 
+                cursor.close()
+
+            self.log.debug("Got stats of %d/%d players" % (len(found), len(unique)))
+
+            return {login: found.get(login.lower()) for login in unique}
+
+        except DatabaseException as e:
+            raise e
         except Exception as e:
-            self.log.error("Could not retrieve player data for login %s" % (login), stack_info=e)
+            self.log.error("Could not retrieve player data for %d logins" % (len(unique)), stack_info=e)
         
         return None
+
+    def iterPlayerStats(self, chunkSize, afterId=0, since=None):
+        """Stream the stats of all players, ordered by player id.
+        
+        Pages through the players with keyset pagination on the player id,
+        so each chunk is a cheap index range scan.
+        
+        Arguments:
+            chunkSize {int} -- Number of players per chunk.
+            afterId {int} -- Only return players with a higher id (to resume).
+            since {string} -- Only return players whose stats were updated at or after this time.
+        
+        Yields:
+            list -- Stats of the players in the next chunk.
+        """
+        lastId = afterId
+
+        while True:
+            where = 'players.id > %s'
+            params = [lastId]
+
+            if since is not None:
+                where += ' AND stats.updated_at >= %s'
+                params.append(since)
+
+            with self.pool.connection() as db:
+                cursor = db.cursor(dictionary=True)
+                cursor.execute(self._statsQuery(where) + ' ORDER BY players.id LIMIT %s', tuple(params + [chunkSize]))
+                players = cursor.fetchall()
+                cursor.close()
+
+            if len(players) == 0:
+                return
+
+            for player in players:
+                player['record_rank_avg'] = float(player['record_rank_avg'])
+
+            lastId = players[-1]['id']
+            yield players
+
+    def createClassificationsTable(self, table):
+        """Create the table classification results are saved to, if it doesn't exist.
+        
+        Arguments:
+            table {string} -- Name of the results table.
+        """
+        with self.pool.connection() as db:
+            cursor = db.cursor()
+            cursor.execute(
+                'CREATE TABLE IF NOT EXISTS `%s` ('
+                'Player INT UNSIGNED NOT NULL PRIMARY KEY, '
+                'Login VARCHAR(255) NOT NULL, '
+                'Experienced FLOAT NOT NULL, '
+                'Beginner FLOAT NOT NULL, '
+                'Model VARCHAR(255) NOT NULL, '
+                'updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP)' % (table)
+            )
+            cursor.close()
+
+    def saveClassifications(self, table, rows):
+        """Insert or update classification results with a single bulk insert.
+        
+        Arguments:
+            table {string} -- Name of the results table.
+            rows {list} -- List of (player id, login, experienced, beginner, model) tuples.
+        """
+        with self.pool.connection() as db:
+            cursor = db.cursor()
+            cursor.executemany(
+                'INSERT INTO `%s` (Player, Login, Experienced, Beginner, Model) VALUES (%%s, %%s, %%s, %%s, %%s) '
+                'ON DUPLICATE KEY UPDATE Login=VALUES(Login), Experienced=VALUES(Experienced), Beginner=VALUES(Beginner), Model=VALUES(Model)' % (table),
+                rows
+            )
+            db.commit()
+            cursor.close()
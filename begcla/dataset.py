@@ -0,0 +1,168 @@
+import os
+import json
+import hashlib
+import numpy as np
+from begcla.features import DATASET_COLUMNS
+
+def fileHash(filename):
+    sha = hashlib.sha1()
+
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+def hashRows(rows):
+    """Fingerprint dataset rows, the fingerprint of a row changes when any of its values do.
+    
+    Arguments:
+        rows {ndarray} -- float64 matrix with one row per datapoint and all DATASET_COLUMNS.
+    
+    Returns:
+        ndarray -- uint64 fingerprint of each row.
+    """
+    bits = np.ascontiguousarray(rows, dtype=np.float64).view(np.uint64)
+    hashes = np.full(len(rows), 0xcbf29ce484222325, dtype=np.uint64)
+
+    # FNV-1a over the values of each row
+    for i in range(bits.shape[1]):
+        hashes = (hashes ^ bits[:, i]) * np.uint64(0x100000001b3)
+
+    return hashes
+
+def iterVoteRows(filename, blockSize=1 << 16):
+    """Stream the rows of a vote export (json_db.json format) without loading the whole file.
+    
+    Arguments:
+        filename {string} -- Path to the json file.
+        blockSize {int} -- Number of characters read at a time.
+    
+    Yields:
+        tuple -- Login and whether the player was voted a beginner.
+    """
+    decoder = json.JSONDecoder()
+
+    with open(filename, 'r') as f:
+        buf = ''
+        pos = -1
+
+        # find the start of the rows array
+        while pos < 0:
+            block = f.read(blockSize)
+            if block == '':
+                raise ValueError("No 'rows' array found in %s" % (filename))
+
+            buf += block
+            pos = buf.find('"rows"')
+
+        buf = buf[pos + len('"rows"'):]
+        while buf.lstrip(' \t\r\n:') == '':
+            block = f.read(blockSize)
+            if block == '':
+                raise ValueError("Unexpected end of %s" % (filename))
+            buf += block
+
+        buf = buf.lstrip(' \t\r\n:')
+        if buf[0] != '[':
+            raise ValueError("'rows' in %s is not an array" % (filename))
+
+        pos = 1
+        eof = False
+        while True:
+            # skip separators between rows
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+
+            if pos < len(buf) and buf[pos] == ']':
+                return
+
+            try:
+                (row, end) = decoder.raw_decode(buf, pos)
+            except ValueError as e:
+                if eof:
+                    raise e
+
+                # the row is incomplete, read more
+                block = f.read(blockSize)
+                eof = block == ''
+                buf = buf[pos:] + block
+                pos = 0
+                continue
+
+            pos = end
+            yield (row['name'], row['votes'] == 'beginner')
+
+def _parseRows(lines, log):
+    numColumns = len(DATASET_COLUMNS)
+    valid = [line for line in lines if line.count(',') == numColumns - 1]
+
+    if len(valid) != len(lines):
+        log.warning('Skipping %d dataset rows with a wrong number of columns.' % (len(lines) - len(valid)))
+
+    try:
+        rows = np.array(','.join(valid).split(','), dtype=np.float64).reshape((-1, numColumns))
+    except ValueError:
+        # slow path, only taken when some rows are not numeric
+        rows = []
+        for line in valid:
+            try:
+                rows.append([float(v) for v in line.split(',')])
+            except ValueError:
+                log.warning('Skipping non-numeric dataset row: %s' % (line))
+
+        rows = np.array(rows, dtype=np.float64).reshape((-1, numColumns))
+
+    keep = np.all(np.isfinite(rows), axis=1) & np.isin(rows[:, -1], (0, 1))
+    if not np.all(keep):
+        log.warning('Skipping %d dataset rows with invalid values or labels.' % (np.count_nonzero(~keep)))
+
+    return rows[keep]
+
+def loadRows(filename, log, cacheDir=None):
+    """Parse and validate all rows of a dataset CSV.
+    
+    Arguments:
+        filename {string} -- Path to the dataset CSV.
+        log {Logger} -- Logger to use.
+        cacheDir {string} -- Directory of the parsed dataset cache, None to disable caching.
+    
+    Returns:
+        ndarray -- float64 matrix with one row per datapoint and all DATASET_COLUMNS.
+    """
+    cacheFile = None
+
+    if cacheDir is not None:
+        cacheFile = os.path.join(cacheDir, fileHash(filename) + '.npy')
+
+        if os.path.exists(cacheFile):
+            log.debug('Loading dataset %s from cache %s' % (filename, cacheFile))
+            return np.load(cacheFile)
+
+    with open(filename) as f:
+        lines = [line.strip() for line in f.read().splitlines()]
+
+    rows = _parseRows([line for line in lines if line != ''], log)
+
+    if cacheFile is not None:
+        os.makedirs(cacheDir, exist_ok=True)
+        np.save(cacheFile, rows)
+        log.debug('Cached dataset %s to %s' % (filename, cacheFile))
+
+    return rows
+
+def loadDataset(filename, schema, log, cacheDir=None):
+    """Load the datapoints and labels of a dataset CSV.
+    
+    Arguments:
+        filename {string} -- Path to the dataset CSV.
+        schema {FeatureSchema} -- Features to use.
+        log {Logger} -- Logger to use.
+        cacheDir {string} -- Directory of the parsed dataset cache, None to disable caching.
+    
+    Returns:
+        tuple -- float32 datapoints and int labels.
+    """
+    rows = loadRows(filename, log, cacheDir)
+
+    return (schema.fromRows(rows), rows[:, -1].astype(np.int64))
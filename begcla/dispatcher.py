@@ -0,0 +1,143 @@
+import time
+from threading import Thread, Event
+from queue import Queue, Empty
+
+class BatchRequest:
+    def __init__(self, points, key=None):
+        self.points = points
+        self.key = key
+        self.results = None
+        self.error = None
+        self.done = Event()
+
+    def wait(self):
+        """Block until the dispatcher has classified the request.
+        
+        Returns:
+            list -- Prediction row of each datapoint.
+        """
+        self.done.wait()
+
+        if self.error is not None:
+            raise self.error
+
+        return self.results
+
+class BatchDispatcher:
+    def __init__(self, predict, log, maxBatchSize, maxBatchDelay):
+        """Collects classification requests from all clients and runs them
+        through the model in batches.
+        
+        Arguments:
+            predict {callable} -- Function predicting a list of datapoints with the model given by a request key, returning one row per datapoint.
+            log {Logger} -- Logger to use.
+            maxBatchSize {int} -- A batch is dispatched once it holds at least this many datapoints.
+            maxBatchDelay {float} -- Max time in seconds to wait for more requests before dispatching.
+        """
+        self.predict = predict
+        self.log = log
+        self.maxBatchSize = maxBatchSize
+        self.maxBatchDelay = maxBatchDelay
+        self.queue = Queue()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = Thread(target=self._dispatch_thread, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def submit(self, points, key=None):
+        """Queue datapoints for prediction in the next batch.
+        
+        Arguments:
+            points {list} -- Datapoints to classify.
+            key {object} -- Model to classify them with, requests are only batched with requests of the same key.
+        
+        Returns:
+            BatchRequest -- Request object to wait on for the result.
+        """
+        request = BatchRequest(points, key)
+        self.queue.put(request)
+        return request
+
+    def _collect(self, first):
+        batch = [first]
+        size = len(first.points)
+        deadline = time.time() + self.maxBatchDelay
+
+        while size < self.maxBatchSize:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+
+            try:
+                request = self.queue.get(timeout=timeout)
+            except Empty:
+                break
+
+            if request is None:
+                self.running = False
+                break
+
+            batch.append(request)
+            size += len(request.points)
+
+        return batch
+
+    def _run(self, batch):
+        groups = {}
+        for request in batch:
+            groups.setdefault(request.key, []).append(request)
+
+        for (key, requests) in groups.items():
+            self._runGroup(key, requests)
+
+    def _runGroup(self, key, batch):
+        points = []
+        for request in batch:
+            points.extend(request.points)
+
+        self.log.debug('Dispatching batch of %d requests (%d datapoints).' % (len(batch), len(points)))
+
+        try:
+            predictions = self.predict(points, key)
+
+            offset = 0
+            for request in batch:
+                request.results = predictions[offset:offset + len(request.points)]
+                offset += len(request.points)
+        except Exception as e:
+            for request in batch:
+                request.error = e
+        finally:
+            for request in batch:
+                request.done.set()
+
+    def _dispatch_thread(self):
+        while self.running:
+            request = self.queue.get()
+
+            if request is None:
+                break
+
+            self._run(self._collect(request))
+
+        # fail requests still waiting so no client hangs
+        while True:
+            try:
+                request = self.queue.get_nowait()
+            except Empty:
+                break
+
+            if request is not None:
+                request.error = Exception('Dispatcher stopped.')
+                request.done.set()
@@ -0,0 +1,74 @@
+import numpy as np
+
+# canonical order of the features, datapoints always use this order
+FEATURES = ['visits', 'play_time', 'finishes', 'locals', 'wins', 'score', 'rank', 'record_rank_avg', 'num_pbs']
+
+# columns of a dataset CSV row as written by CmdDataset
+DATASET_COLUMNS = ['id'] + FEATURES + ['label']
+
+class FeatureSchemaException(Exception):
+    pass
+
+class FeatureSchema:
+    def __init__(self, dataValues):
+        """The features used by a model and how to extract them.
+        
+        Arguments:
+            dataValues {list} -- Data-point values to use, in any order.
+        
+        Raises:
+            FeatureSchemaException: If a data-point value is unknown.
+        """
+        unknown = [name for name in dataValues if name not in FEATURES]
+        if len(unknown) > 0:
+            raise FeatureSchemaException('Unknown data-point values: ' + ','.join(unknown))
+
+        self.names = [name for name in FEATURES if name in dataValues]
+        self.columns = np.array([DATASET_COLUMNS.index(name) for name in self.names])
+
+    def __eq__(self, other):
+        return isinstance(other, FeatureSchema) and self.names == other.names
+
+    def __len__(self):
+        return len(self.names)
+
+    def __str__(self):
+        return ','.join(self.names)
+
+    def fromStats(self, records):
+        """Build datapoints from player stats.
+        
+        Arguments:
+            records {list} -- Stats dicts as returned by EvoSCDB.
+        
+        Returns:
+            ndarray -- float32 matrix with one datapoint per record.
+        """
+        return np.array([[record[name] for name in self.names] for record in records], dtype=np.float32).reshape((-1, len(self.names)))
+
+    def fromRows(self, rows):
+        """Select the datapoints from parsed dataset rows.
+        
+        Arguments:
+            rows {ndarray} -- Matrix of rows with all DATASET_COLUMNS.
+        
+        Returns:
+            ndarray -- float32 matrix with one datapoint per row.
+        """
+        return rows[:, self.columns].astype(np.float32)
+
+    def checkModel(self, modelValues, inputSize):
+        """Make sure a model was trained on this schema.
+        
+        Arguments:
+            modelValues {list} -- Data-point values recorded in the model, None if it doesn't record them.
+            inputSize {int} -- Size of the model's input layer.
+        
+        Raises:
+            FeatureSchemaException: If the model was trained on other features.
+        """
+        if modelValues is not None and FeatureSchema(modelValues) != self:
+            raise FeatureSchemaException("Model was trained on '%s' but '%s' was requested." % (str(FeatureSchema(modelValues)), str(self)))
+
+        if inputSize is not None and inputSize != len(self):
+            raise FeatureSchemaException("Model expects %d values but '%s' has %d." % (inputSize, str(self), len(self)))
@@ -0,0 +1,82 @@
+from struct import unpack_from
+from begcla.wire import splitHeader, MAX_BODY_SIZE
+
+class FramingException(Exception):
+    pass
+
+class FramedSocket:
+    def __init__(self, sock, maxFrameSize=MAX_BODY_SIZE, blockSize=65536):
+        """Length-prefixed framing on top of a socket, receiving into a
+        reusable buffer without intermediate copies.
+        
+        Arguments:
+            sock {socket} -- Connected socket.
+            maxFrameSize {int} -- Max accepted body size in bytes.
+            blockSize {int} -- Max number of bytes read per recv call.
+        """
+        self.sock = sock
+        self.maxFrameSize = min(maxFrameSize, MAX_BODY_SIZE)
+        self.blockSize = blockSize
+        self.header = bytearray(4)
+        self.buffer = bytearray(min(blockSize, self.maxFrameSize))
+
+    def _recvExactly(self, view):
+        """Fill the view from the socket.
+        
+        Returns:
+            bool -- False if the connection was closed before any byte was read.
+        
+        Raises:
+            FramingException: If the connection was closed in the middle of the view.
+        """
+        nread = 0
+        total = len(view)
+
+        while nread < total:
+            n = self.sock.recv_into(view[nread:], min(total - nread, self.blockSize))
+
+            if n == 0:
+                if nread == 0:
+                    return False
+                raise FramingException('Connection closed after %d of %d bytes.' % (nread, total))
+
+            nread += n
+
+        return True
+
+    def recvFrame(self):
+        """Recieve the next frame.
+        
+        The returned body is a view into an internal buffer that is reused by the
+        next call, so it must be consumed before recieving again.
+        
+        Returns:
+            tuple -- Header flags and a memoryview of the body, None if the connection was closed.
+        
+        Raises:
+            FramingException: If the frame is too large or the connection broke mid-frame.
+        """
+        if not self._recvExactly(memoryview(self.header)):
+            return None
+
+        (size, flags) = splitHeader(unpack_from('<I', self.header)[0])
+
+        if size > self.maxFrameSize:
+            raise FramingException('Frame of %d bytes exceeds the max frame size of %d bytes.' % (size, self.maxFrameSize))
+
+        if size > len(self.buffer):
+            self.buffer = bytearray(size)
+
+        body = memoryview(self.buffer)[:size]
+        if size > 0 and not self._recvExactly(body):
+            raise FramingException('Connection closed before the frame body.')
+
+        return (flags, body)
+
+    def send(self, data):
+        """Send an encoded packet.
+        
+        Arguments:
+            data {bytes} -- Packet including its header.
+        """
+        self.sock.sendall(memoryview(data))
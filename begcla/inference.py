@@ -0,0 +1,309 @@
+import json
+import numpy as np
+from struct import pack, unpack
+
+# exported model file: magic, version, metadata size, json metadata, aligned weight arrays
+EXPORT_MAGIC = b'BCLA'
+EXPORT_VERSION = 1
+EXPORT_ALIGNMENT = 64
+
+def _linear(x):
+    return x
+
+def _relu(x):
+    return np.maximum(x, 0)
+
+def _sigmoid(x):
+    return np.exp(-np.logaddexp(0, -x))
+
+def _hard_sigmoid(x):
+    return np.clip(0.2 * x + 0.5, 0, 1)
+
+def _softmax(x):
+    e = np.exp(x - np.max(x, axis=-1, keepdims=True))
+    return e / np.sum(e, axis=-1, keepdims=True)
+
+def _softplus(x):
+    return np.logaddexp(x, 0)
+
+def _softsign(x):
+    return x / (np.abs(x) + 1)
+
+def _elu(x):
+    return np.where(x > 0, x, np.expm1(np.minimum(x, 0)))
+
+def _selu(x):
+    return 1.0507009873554805 * np.where(x > 0, x, 1.6732632423543772 * np.expm1(np.minimum(x, 0)))
+
+ACTIVATIONS = {
+    'linear': _linear,
+    'relu': _relu,
+    'sigmoid': _sigmoid,
+    'hard_sigmoid': _hard_sigmoid,
+    'softmax': _softmax,
+    'softplus': _softplus,
+    'softsign': _softsign,
+    'tanh': np.tanh,
+    'elu': _elu,
+    'selu': _selu,
+    'exponential': np.exp
+}
+
+class NumpyModel:
+    def __init__(self, layers, dataValues=None):
+        """Feed-forward model evaluated with plain NumPy.
+        
+        Arguments:
+            layers {list} -- List of (kernel, bias, activation) tuples, kernel and bias may be None for activation-only layers.
+            dataValues {list} -- Data-point values the model was trained on, if known.
+        """
+        self.layers = layers
+        self.dataValues = dataValues
+
+    @staticmethod
+    def _readLayers(modelConfig, weights):
+        config = modelConfig['config']
+        if type(config) is dict:
+            config = config['layers']
+
+        layers = []
+        for layer in config:
+            className = layer['class_name']
+            layerConfig = layer['config']
+
+            if className == 'Dense':
+                group = weights[layerConfig['name']]
+                names = [n.decode('utf8') if type(n) is bytes else n for n in group.attrs['weight_names']]
+                kernel = np.array(group[names[0]], dtype=np.float32)
+                bias = np.array(group[names[1]], dtype=np.float32) if layerConfig.get('use_bias', True) else None
+                layers.append((kernel, bias, layerConfig.get('activation', 'linear')))
+            elif className == 'Activation':
+                layers.append((None, None, layerConfig['activation']))
+            elif className in ('Dropout', 'InputLayer'):
+                # no-ops at inference time
+                continue
+            else:
+                raise Exception("Layer type '%s' is not supported by the numpy backend." % (className))
+
+            if layers[-1][2] not in ACTIVATIONS:
+                raise Exception("Activation '%s' is not supported by the numpy backend." % (layers[-1][2]))
+
+        return layers
+
+    @staticmethod
+    def load(modelfile):
+        """Load the layers of a Sequential model saved by Keras.
+        
+        Arguments:
+            modelfile {string} -- Path to the .h5 model file.
+        
+        Returns:
+            NumpyModel -- The loaded model.
+        """
+        import h5py
+
+        with h5py.File(modelfile, 'r') as f:
+            modelConfig = f.attrs['model_config']
+            if type(modelConfig) is bytes:
+                modelConfig = modelConfig.decode('utf8')
+
+            weights = f['model_weights'] if 'model_weights' in f else f
+            return NumpyModel(NumpyModel._readLayers(json.loads(modelConfig), weights))
+
+    def predict(self, x):
+        out = np.asarray(x, dtype=np.float32)
+
+        for (kernel, bias, activation) in self.layers:
+            if kernel is not None:
+                out = np.dot(out, kernel)
+            if bias is not None:
+                out = out + bias
+
+            out = ACTIVATIONS[activation](out)
+
+        return out
+
+    @staticmethod
+    def isExported(modelfile):
+        with open(modelfile, 'rb') as f:
+            return f.read(len(EXPORT_MAGIC)) == EXPORT_MAGIC
+
+    def export(self, outfile, dtype='float32'):
+        """Save the model as a compact file that can be memory-mapped.
+        
+        Arguments:
+            outfile {string} -- Path of the file to write.
+            dtype {string} -- Data type of the stored weights, float32 or float16.
+        """
+        meta = {
+            'dtype': dtype,
+            'dt_values': self.dataValues,
+            'layers': []
+        }
+        arrays = []
+        offset = 0
+
+        def addArray(array):
+            nonlocal offset
+            if array is None:
+                return None
+
+            array = np.ascontiguousarray(array, dtype=dtype)
+            info = {'offset': offset, 'shape': list(array.shape)}
+            arrays.append(array)
+            offset += -(-array.nbytes // EXPORT_ALIGNMENT) * EXPORT_ALIGNMENT
+            return info
+
+        for (kernel, bias, activation) in self.layers:
+            meta['layers'].append({
+                'kernel': addArray(kernel),
+                'bias': addArray(bias),
+                'activation': activation
+            })
+
+        metaBytes = json.dumps(meta).encode('utf8')
+        header = EXPORT_MAGIC + pack('<II', EXPORT_VERSION, len(metaBytes)) + metaBytes
+        header += b'\0' * (-len(header) % EXPORT_ALIGNMENT)
+
+        with open(outfile, 'wb') as f:
+            f.write(header)
+            for array in arrays:
+                f.write(array.tobytes())
+                f.write(b'\0' * (-array.nbytes % EXPORT_ALIGNMENT))
+
+    @staticmethod
+    def loadExported(modelfile):
+        """Load a model written by NumpyModel.export.
+        
+        float32 weights are memory-mapped, so processes loading the same file
+        share its pages. float16 weights are converted to float32 on load.
+        
+        Arguments:
+            modelfile {string} -- Path to the exported model file.
+        
+        Returns:
+            NumpyModel -- The loaded model.
+        """
+        with open(modelfile, 'rb') as f:
+            (magic, version, metaSize) = unpack('<4sII', f.read(12))
+            if magic != EXPORT_MAGIC or version != EXPORT_VERSION:
+                raise Exception("'%s' is not a supported exported model." % (modelfile))
+
+            meta = json.loads(f.read(metaSize).decode('utf8'))
+
+        dataStart = 12 + metaSize
+        dataStart += -dataStart % EXPORT_ALIGNMENT
+        data = np.memmap(modelfile, dtype=np.uint8, mode='r')
+
+        def getArray(info):
+            if info is None:
+                return None
+
+            array = np.ndarray(info['shape'], dtype=meta['dtype'], buffer=data, offset=dataStart + info['offset'])
+            return array if array.dtype == np.float32 else array.astype(np.float32)
+
+        layers = []
+        for layer in meta['layers']:
+            if layer['activation'] not in ACTIVATIONS:
+                raise Exception("Activation '%s' is not supported by the numpy backend." % (layer['activation']))
+
+            layers.append((getArray(layer['kernel']), getArray(layer['bias']), layer['activation']))
+
+        return NumpyModel(layers, meta['dt_values'])
+
+def getModelDataValues(modelfile):
+    """Get the data-point values a model was trained on.
+    
+    Arguments:
+        modelfile {string} -- Path to the model file.
+    
+    Returns:
+        list -- Data-point values, None if the model doesn't record them.
+    """
+    if NumpyModel.isExported(modelfile):
+        return NumpyModel.loadExported(modelfile).dataValues
+
+    import h5py
+
+    with h5py.File(modelfile, 'r') as f:
+        dataValues = f.attrs.get('begcla_dt_values')
+
+    if dataValues is None:
+        return None
+    if type(dataValues) is bytes:
+        dataValues = dataValues.decode('utf8')
+
+    return dataValues.split(',')
+
+def recordModelDataValues(modelfile, dataValues):
+    """Record the data-point values a model was trained on in a Keras .h5 file.
+    
+    Arguments:
+        modelfile {string} -- Path to the .h5 model file.
+        dataValues {list} -- Data-point values.
+    """
+    import h5py
+
+    with h5py.File(modelfile, 'a') as f:
+        f.attrs['begcla_dt_values'] = ','.join(dataValues)
+
+def getModelRows(modelfile):
+    """Get the fingerprints of the datapoints a Keras .h5 model was trained on.
+    
+    Arguments:
+        modelfile {string} -- Path to the .h5 model file.
+    
+    Returns:
+        ndarray -- Sorted uint64 row fingerprints, None if the model doesn't record them.
+    """
+    import h5py
+
+    with h5py.File(modelfile, 'r') as f:
+        if 'begcla_rows' not in f:
+            return None
+
+        return np.array(f['begcla_rows'], dtype=np.uint64)
+
+def recordModelRows(modelfile, hashes):
+    """Record the fingerprints of the datapoints a model was trained on in a
+    Keras .h5 file, so it can later be fine-tuned on the new ones only.
+    
+    Arguments:
+        modelfile {string} -- Path to the .h5 model file.
+        hashes {ndarray} -- uint64 row fingerprints.
+    """
+    import h5py
+
+    with h5py.File(modelfile, 'a') as f:
+        if 'begcla_rows' in f:
+            del f['begcla_rows']
+        f.create_dataset('begcla_rows', data=np.unique(hashes), compression='gzip')
+
+def getModelInputSize(model):
+    if isinstance(model, NumpyModel):
+        return model.layers[0][0].shape[0]
+
+    return model.input_shape[-1]
+
+def loadModel(modelfile, backend):
+    """Load a model for inference.
+    
+    Arguments:
+        modelfile {string} -- Path to the model file.
+        backend {string} -- 'keras' to use Keras/TensorFlow, 'numpy' to evaluate the model with NumPy only.
+    
+    Returns:
+        object -- Model with a predict method.
+    """
+    # exported models can only be evaluated by the numpy backend
+    if NumpyModel.isExported(modelfile):
+        return NumpyModel.loadExported(modelfile)
+
+    if backend == 'numpy':
+        return NumpyModel.load(modelfile)
+
+    from keras.models import load_model
+
+    model = load_model(modelfile)
+    model._make_predict_function() # initialize model so that it is thread-safe
+    return model
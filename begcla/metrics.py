@@ -0,0 +1,215 @@
+import time
+from bisect import bisect_left
+from threading import Thread, Lock
+from contextlib import contextmanager
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+# upper bounds of the latency buckets in seconds, the last bucket catches everything above
+BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+STAGES = ['accept', 'receive', 'queue_wait', 'db_fetch', 'feature_build', 'inference', 'serialize', 'send']
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q, counts, count):
+        """Estimate a quantile as the upper bound of the bucket it falls in.
+
+        Arguments:
+            q {float} -- Quantile between 0 and 1.
+            counts {list} -- Bucket counts.
+            count {int} -- Total count.
+
+        Returns:
+            float -- Upper bound of the bucket, None if nothing was observed.
+        """
+        if count == 0:
+            return None
+
+        rank = q * count
+        seen = 0
+        for (i, n) in enumerate(counts):
+            seen += n
+            if seen >= rank and n > 0:
+                return self.buckets[i] if i < len(self.buckets) else float('inf')
+
+        return float('inf')
+
+    def snapshot(self):
+        with self.lock:
+            return (list(self.counts), self.sum, self.count)
+
+    def getStats(self):
+        (counts, total, count) = self.snapshot()
+
+        return {
+            'count': count,
+            'mean': 0 if count == 0 else total / count,
+            'p50': self.quantile(0.5, counts, count),
+            'p99': self.quantile(0.99, counts, count)
+        }
+
+class Metrics:
+    def __init__(self):
+        """Latency histograms of the server's request stages, and counters.
+        Collection only takes a lock per observation, so it is always on.
+        """
+        self.stages = {}
+        for stage in STAGES:
+            self.stages[stage] = Histogram()
+
+        self.lock = Lock()
+        self.counters = {}
+        self.errors = {}
+
+    def observe(self, stage, seconds):
+        self.stages[stage].observe(seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        """Time the body of a with statement as a stage.
+
+        Arguments:
+            stage {string} -- Name of the stage, one of STAGES.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[stage].observe(time.perf_counter() - start)
+
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def countError(self, errno):
+        with self.lock:
+            self.errors[errno] = self.errors.get(errno, 0) + 1
+
+    def getStats(self):
+        """Get the stage latencies and counters.
+
+        Returns:
+            dict -- Metrics, latencies are in seconds.
+        """
+        with self.lock:
+            counters = dict(self.counters)
+            errors = dict((str(errno), n) for (errno, n) in self.errors.items())
+
+        return {
+            'stages': dict((stage, self.stages[stage].getStats()) for stage in STAGES),
+            'counters': counters,
+            'errors': errors
+        }
+
+    def render(self, gauges):
+        """Render all metrics in the Prometheus text format.
+
+        Arguments:
+            gauges {dict} -- Current values to include, by name.
+
+        Returns:
+            string -- Metrics text.
+        """
+        lines = ['# TYPE begcla_stage_seconds histogram']
+
+        for stage in STAGES:
+            histogram = self.stages[stage]
+            (counts, total, count) = histogram.snapshot()
+
+            cumulative = 0
+            for (i, n) in enumerate(counts):
+                cumulative += n
+                le = '+Inf' if i == len(histogram.buckets) else repr(histogram.buckets[i])
+                lines.append('begcla_stage_seconds_bucket{stage="%s",le="%s"} %d' % (stage, le, cumulative))
+
+            lines.append('begcla_stage_seconds_sum{stage="%s"} %r' % (stage, total))
+            lines.append('begcla_stage_seconds_count{stage="%s"} %d' % (stage, count))
+
+        with self.lock:
+            counters = sorted(self.counters.items())
+            errors = sorted(self.errors.items())
+
+        for (name, value) in counters:
+            lines.append('# TYPE begcla_%s_total counter' % (name))
+            lines.append('begcla_%s_total %d' % (name, value))
+
+        lines.append('# TYPE begcla_errors_total counter')
+        for (errno, value) in errors:
+            lines.append('begcla_errors_total{errno="%d"} %d' % (errno, value))
+
+        for (name, value) in sorted(gauges.items()):
+            if value is None:
+                continue
+            lines.append('# TYPE begcla_%s gauge' % (name))
+            lines.append('begcla_%s %r' % (name, value))
+
+        return '\n'.join(lines) + '\n'
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class MetricsServer:
+    def __init__(self, config, log, server):
+        """Plain-text HTTP endpoint exposing the metrics of a prediction server
+        on a separate port.
+
+        Arguments:
+            config {ConfigParser} -- Configuration with a [Metrics] section.
+            log {Logger} -- Logger to use.
+            server {PredictionServer} -- Server to expose the metrics of.
+        """
+        self.log = log
+        self.server = server
+        self.address = config['Metrics'].get('ListenAddress', '127.0.0.1')
+        self.port = int(config['Metrics'].get('ListenPort', '4006'))
+        self.httpd = None
+        self.thread = None
+
+    def _makeHandler(self):
+        metricsServer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+
+                body = metricsServer.server.metrics.render(metricsServer.server.getGauges()).encode('utf8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                metricsServer.log.debug('Metrics request: ' + (format % args))
+
+        return Handler
+
+    def start(self):
+        self.log.debug('Serving metrics on http://%s:%d/metrics' % (self.address, self.port))
+        self.httpd = _ThreadingHTTPServer((self.address, self.port), self._makeHandler())
+        self.thread = Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+            self.thread = None
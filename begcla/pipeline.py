@@ -0,0 +1,310 @@
+import os
+import glob
+import logging
+import numpy as np
+from threading import Thread
+from queue import Queue
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from begcla.dataset import fileHash, hashRows, _parseRows
+from begcla.features import DATASET_COLUMNS
+
+# bytes of CSV parsed per task, and rows read per chunk from a cached shard
+CHUNK_BYTES = 4 << 20
+CHUNK_ROWS = 65536
+
+def expandShards(patterns):
+    """Expand glob patterns to dataset shard files.
+
+    Arguments:
+        patterns {list} -- Files or glob patterns.
+
+    Returns:
+        list -- Shard files, patterns matching nothing are kept as they are.
+    """
+    shards = []
+
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        shards.extend(matches if len(matches) > 0 else [pattern])
+
+    return shards
+
+def _hashIds(ids):
+    # spreads player ids evenly over [0, 2^24)
+    return (ids.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(40)
+
+def isValidation(ids, fraction):
+    """Assign datapoints to the validation split by their player id, so a
+    player always ends up in the same split without keeping a list of them.
+
+    Arguments:
+        ids {ndarray} -- Player ids.
+        fraction {float} -- Fraction of the players to hold out.
+
+    Returns:
+        ndarray -- Boolean mask of the validation datapoints.
+    """
+    return _hashIds(ids) < np.uint64(fraction * (1 << 24))
+
+def getFolds(ids, k):
+    """Assign datapoints to one of k cross-validation folds by their player id.
+
+    Arguments:
+        ids {ndarray} -- Player ids.
+        k {int} -- Number of folds.
+
+    Returns:
+        ndarray -- Fold of each datapoint, from 0 to k-1.
+    """
+    return ((_hashIds(ids) * np.uint64(k)) >> np.uint64(24)).astype(np.int64)
+
+def _parseRange(filename, start, end, logName):
+    # runs in a worker process, parses the lines starting in [start, end)
+    log = logging.getLogger(logName)
+
+    with open(filename, 'rb') as f:
+        if start > 0:
+            # the line cut by start belongs to the previous range
+            f.seek(start - 1)
+            f.readline()
+
+        lines = []
+        while f.tell() < end:
+            line = f.readline()
+            if line == b'':
+                break
+
+            line = line.strip()
+            if line != b'':
+                lines.append(line.decode('utf8'))
+
+    if len(lines) == 0:
+        return np.zeros((0, len(DATASET_COLUMNS)))
+
+    return _parseRows(lines, log)
+
+class TrainingPipeline:
+    def __init__(self, shards, schema, log, batchSize, cacheDir=None, workers=4, shuffleBuffer=100000, prefetch=8, validationSplit=0.0, seed=None):
+        """Streams batches from dataset shards for training, without loading
+        the whole dataset. CSV shards are parsed by a pool of processes, or
+        read from their binary cache, and shuffled through a bounded buffer.
+        Batches are prepared in the background while the model trains.
+
+        Arguments:
+            shards {list} -- Dataset CSV files.
+            schema {FeatureSchema} -- Features to use.
+            log {Logger} -- Logger to use.
+            batchSize {int} -- Datapoints per batch.
+            cacheDir {string} -- Directory of the parsed dataset cache, None to parse the CSVs on every epoch.
+            workers {int} -- Number of processes parsing CSVs.
+            shuffleBuffer {int} -- Datapoints shuffled together.
+            prefetch {int} -- Batches prepared ahead of training.
+            validationSplit {float} -- Fraction of the players held out for validation.
+            seed {int} -- Random seed of the shuffling.
+        """
+        self.shards = shards
+        self.schema = schema
+        self.log = log
+        self.batchSize = batchSize
+        self.cacheDir = cacheDir
+        self.workers = workers
+        self.shuffleBuffer = max(shuffleBuffer, batchSize)
+        self.prefetch = prefetch
+        self.validationSplit = validationSplit
+        self.random = np.random.RandomState(seed)
+        self.executor = None
+        self.cacheFiles = {}
+        self.counts = None
+        self.rowHashes = None
+
+    def __enter__(self):
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.executor.shutdown()
+        self.executor = None
+
+    def _ranges(self, filename):
+        size = os.path.getsize(filename)
+        return [(start, min(start + CHUNK_BYTES, size)) for start in range(0, size, CHUNK_BYTES)]
+
+    def _iterParsed(self, tasks):
+        # parse (filename, start, end) tasks on the process pool, with a bounded number in flight
+        pending = deque()
+        tasks = iter(tasks)
+
+        while True:
+            while len(pending) < self.workers * 2:
+                task = next(tasks, None)
+                if task is None:
+                    break
+                pending.append(self.executor.submit(_parseRange, task[0], task[1], task[2], self.log.name))
+
+            if len(pending) == 0:
+                return
+
+            yield pending.popleft().result()
+
+    def _buildCache(self, filename, cacheFile):
+        self.log.info('Caching dataset shard %s to %s' % (filename, cacheFile))
+        rawFile = cacheFile + '.raw'
+        tmpFile = cacheFile + '.tmp.npy'
+        numRows = 0
+
+        with open(rawFile, 'wb') as f:
+            for rows in self._iterParsed((filename, start, end) for (start, end) in self._ranges(filename)):
+                f.write(rows.tobytes())
+                numRows += len(rows)
+
+        shape = (numRows, len(DATASET_COLUMNS))
+        out = np.lib.format.open_memmap(tmpFile, mode='w+', dtype=np.float64, shape=shape)
+        if numRows > 0:
+            raw = np.memmap(rawFile, dtype=np.float64, mode='r', shape=shape)
+            for i in range(0, numRows, CHUNK_ROWS):
+                out[i:i + CHUNK_ROWS] = raw[i:i + CHUNK_ROWS]
+            del raw
+        out.flush()
+        del out
+
+        os.replace(tmpFile, cacheFile)
+        os.remove(rawFile)
+
+    def prepare(self):
+        """Build the missing shard caches, count the datapoints of each split
+        and fingerprint the training datapoints.
+
+        Returns:
+            tuple -- Number of training and validation datapoints.
+        """
+        if self.cacheDir is not None:
+            os.makedirs(self.cacheDir, exist_ok=True)
+
+            for shard in self.shards:
+                # same cache as the in-memory loader uses
+                cacheFile = os.path.join(self.cacheDir, fileHash(shard) + '.npy')
+                if not os.path.exists(cacheFile):
+                    self._buildCache(shard, cacheFile)
+                self.cacheFiles[shard] = cacheFile
+
+        counts = [0, 0]
+        hashes = []
+        for rows in self._iterRows(shuffle=False):
+            validation = isValidation(rows[:, 0], self.validationSplit)
+            numValidation = int(np.count_nonzero(validation))
+            counts[0] += len(rows) - numValidation
+            counts[1] += numValidation
+            hashes.append(np.unique(hashRows(rows[~validation])))
+
+        self.counts = tuple(counts)
+        self.rowHashes = np.unique(np.concatenate(hashes)) if len(hashes) > 0 else np.zeros(0, dtype=np.uint64)
+        return self.counts
+
+    def _iterRows(self, shuffle):
+        shards = list(self.shards)
+        if shuffle:
+            self.random.shuffle(shards)
+
+        if self.cacheDir is None:
+            tasks = [(shard, start, end) for shard in shards for (start, end) in self._ranges(shard)]
+            if shuffle:
+                self.random.shuffle(tasks)
+
+            for rows in self._iterParsed(tasks):
+                yield rows
+            return
+
+        for shard in shards:
+            cached = np.load(self.cacheFiles[shard], mmap_mode='r')
+            starts = list(range(0, len(cached), CHUNK_ROWS))
+            if shuffle:
+                self.random.shuffle(starts)
+
+            for start in starts:
+                yield np.array(cached[start:start + CHUNK_ROWS])
+
+    def _makeBatch(self, rows):
+        labels = np.zeros((len(rows), 2), dtype=np.float32)
+        labels[np.arange(len(rows)), rows[:, -1].astype(np.int64)] = 1
+        return (self.schema.fromRows(rows), labels)
+
+    def iterBatches(self, validation):
+        """Go through one split once, in batches.
+
+        Arguments:
+            validation {bool} -- True for the validation split, False for the training split.
+
+        Yields:
+            tuple -- float32 datapoints and one-hot labels.
+        """
+        buffer = []
+        buffered = 0
+
+        for rows in self._iterRows(shuffle=not validation):
+            rows = rows[isValidation(rows[:, 0], self.validationSplit) == validation]
+            buffer.append(rows)
+            buffered += len(rows)
+
+            if buffered < self.shuffleBuffer:
+                continue
+
+            rows = np.concatenate(buffer)
+            if not validation:
+                self.random.shuffle(rows)
+
+            # rows left over after the full batches are shuffled with the next buffer
+            numFull = len(rows) - len(rows) % self.batchSize
+            for i in range(0, numFull, self.batchSize):
+                yield self._makeBatch(rows[i:i + self.batchSize])
+
+            buffer = [rows[numFull:]]
+            buffered = len(rows) - numFull
+
+        if buffered > 0:
+            rows = np.concatenate(buffer)
+            if not validation:
+                self.random.shuffle(rows)
+
+            for i in range(0, len(rows), self.batchSize):
+                yield self._makeBatch(rows[i:i + self.batchSize])
+
+    def getSteps(self, validation):
+        """Number of batches in one pass over a split, prepare() must have been called.
+
+        Arguments:
+            validation {bool} -- True for the validation split, False for the training split.
+
+        Returns:
+            int -- Number of batches.
+        """
+        count = self.counts[1 if validation else 0]
+        return (count + self.batchSize - 1) // self.batchSize
+
+    def _prefetch_thread(self, validation, queue):
+        try:
+            while True:
+                for batch in self.iterBatches(validation):
+                    queue.put(batch)
+        except Exception as e:
+            queue.put(e)
+
+    def generator(self, validation=False):
+        """Endless generator of batches for Keras, with the next batches
+        prepared in a background thread.
+
+        Arguments:
+            validation {bool} -- True for the validation split, False for the training split.
+
+        Yields:
+            tuple -- float32 datapoints and one-hot labels.
+        """
+        queue = Queue(maxsize=self.prefetch)
+        Thread(target=self._prefetch_thread, args=(validation, queue), daemon=True).start()
+
+        while True:
+            batch = queue.get()
+            if isinstance(batch, Exception):
+                raise batch
+
+            yield batch
@@ -0,0 +1,138 @@
+import os
+import time
+import signal
+from begcla.commands.cmd_server import PredictionServer, _raiseExit
+
+# exit code of a worker that can never start, such as one with a model not matching the features
+EXIT_CONFIG = 3
+
+class PreforkMaster:
+    # workers dying sooner than this after starting are restarted with an increasing delay
+    MIN_UPTIME = 5
+    MAX_RESTART_DELAY = 30
+
+    def __init__(self, config, log, makeServer, numWorkers):
+        """Runs several prediction server processes sharing one listening socket.
+        The master binds the socket, forks the workers and restarts workers that
+        die, and passes SIGTERM on to them so they can finish their clients.
+
+        Arguments:
+            config {ConfigParser} -- Configuration.
+            log {Logger} -- Logger to use.
+            makeServer {callable} -- Creates a worker's server from the listening socket, None if the server can't be created.
+            numWorkers {int} -- Number of worker processes.
+        """
+        self.config = config
+        self.log = log
+        self.makeServer = makeServer
+        self.numWorkers = numWorkers
+        self.socket = None
+        self.workers = {}
+        self.stopping = False
+        self.failed = False
+        self.restartDelay = 1
+
+    def _runWorker(self, index):
+        code = 0
+
+        try:
+            # the master decides when workers shut down
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, _raiseExit)
+
+            server = self.makeServer(self.socket)
+            if server is None:
+                code = EXIT_CONFIG
+                return
+
+            # every worker needs its own metrics port
+            if server.metricsServer is not None:
+                server.metricsServer.port += index
+
+            # the first worker refreshes the shared snapshot, the others only load it
+            if server.featureStore is not None:
+                server.featureStore.refresher = index == 0
+
+            self.log.info('Worker %d (pid %d) serving.' % (index, os.getpid()))
+            server.serve()
+        except SystemExit:
+            # stopped by the master before it started serving
+            pass
+        except BaseException as e:
+            self.log.error('Worker %d failed: %s' % (index, str(e)), stack_info=e)
+            code = 1
+        finally:
+            # skip the master's cleanup, such as removing the pid file
+            os._exit(code)
+
+    def _spawn(self, index):
+        pid = os.fork()
+
+        if pid == 0:
+            self._runWorker(index)
+
+        self.log.debug('Started worker %d with pid %d.' % (index, pid))
+        self.workers[pid] = (index, time.monotonic())
+
+    def _stop(self, signum, frame):
+        if not self.stopping:
+            self.log.info('Stopping %d workers ...' % (len(self.workers)))
+        self.stopping = True
+
+        for pid in self.workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def _restart(self, index, started):
+        if time.monotonic() - started < PreforkMaster.MIN_UPTIME:
+            self.log.warn('Worker %d died right after starting, restarting in %d seconds ...' % (index, self.restartDelay))
+            time.sleep(self.restartDelay)
+            self.restartDelay = min(self.restartDelay * 2, PreforkMaster.MAX_RESTART_DELAY)
+        else:
+            self.restartDelay = 1
+
+        if not self.stopping:
+            self._spawn(index)
+
+    def run(self):
+        """Serve until SIGTERM or SIGINT, or until a worker can't start.
+
+        Returns:
+            bool -- False if the workers were stopped because one of them couldn't start.
+        """
+        self.socket = PredictionServer.makeListenSocket(self.config, self.log)
+
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        for index in range(self.numWorkers):
+            self._spawn(index)
+
+        while len(self.workers) > 0:
+            try:
+                (pid, status) = os.wait()
+            except ChildProcessError:
+                break
+
+            if pid not in self.workers:
+                continue
+
+            (index, started) = self.workers.pop(pid)
+            code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+
+            if self.stopping:
+                self.log.debug('Worker %d exited with status %d.' % (index, code))
+            elif code == EXIT_CONFIG:
+                self.log.error('Worker %d could not start, stopping.' % (index))
+                self.failed = True
+                self._stop(signal.SIGTERM, None)
+            else:
+                self.log.warn('Worker %d (pid %d) exited with status %d, restarting ...' % (index, pid, code))
+                self._restart(index, started)
+
+        self.socket.close()
+        self.log.info('All workers stopped.')
+
+        return not self.failed
@@ -0,0 +1,216 @@
+import os
+import time
+import numpy as np
+from threading import Thread, Lock, RLock, Event
+from begcla.inference import loadModel, getModelDataValues, getModelInputSize
+from begcla.features import FeatureSchema, FeatureSchemaException
+
+# name of the [Classifier] Model, used by requests that don't pick a model
+DEFAULT_MODEL = 'default'
+
+class ModelRegistryException(Exception):
+    pass
+
+def getModelId(modelfile):
+    """Identity of a model file, changes when the file is replaced.
+
+    Arguments:
+        modelfile {string} -- Path to the model file.
+
+    Returns:
+        string -- Model identity.
+    """
+    if not os.path.exists(modelfile):
+        return modelfile
+
+    return '%s:%d' % (modelfile, os.stat(modelfile).st_mtime_ns)
+
+class ModelEntry:
+    def __init__(self, name, filename, model):
+        self.name = name
+        self.filename = filename
+        self.model = model
+        self.modelId = getModelId(filename)
+        self.loadedAt = time.time()
+        self.lock = RLock()
+
+    def predict(self, points):
+        """Run the model on a list of datapoints.
+
+        Arguments:
+            points {list} -- Datapoints to classify.
+
+        Returns:
+            ndarray -- Prediction row ([experienced, beginner]) of each datapoint.
+        """
+        with self.lock:
+            return self.model.predict(np.array(points, dtype=np.float32))
+
+class ModelRegistry:
+    def __init__(self, config, log, dataValues):
+        """The models served by the prediction server, by name. A model is
+        reloaded when its file changes or on request: the new model is loaded
+        and warmed up next to the old one, which keeps serving until the new
+        one is swapped in.
+
+        Arguments:
+            config {ConfigParser} -- Configuration, models are read from [Classifier] Model and the [Models] section.
+            log {Logger} -- Logger to use.
+            dataValues {list} -- Data-point values the models must be trained on.
+        """
+        self.log = log
+        self.schema = FeatureSchema(dataValues)
+        self.backend = config['Classifier'].get('Backend', 'keras').lower()
+        self.watch = config['Classifier'].get('Watch', 'false').lower() == 'true'
+        self.watchInterval = float(config['Classifier'].get('WatchInterval', '5'))
+        self.files = {DEFAULT_MODEL: config['Classifier']['Model']}
+        self.models = {}
+        self.failed = {}
+        self.reloadLock = Lock()
+        self.stopEvent = Event()
+        self.thread = None
+
+        if config.has_section('Models'):
+            for (name, filename) in config.items('Models'):
+                self.files[name] = filename
+
+    def _load(self, name, filename):
+        if not os.path.exists(filename):
+            raise ModelRegistryException('Model file %s does not exist.' % (filename))
+
+        self.log.debug('Loading model %s from %s (%s backend)' % (name, filename, self.backend))
+        model = loadModel(filename, self.backend)
+
+        # refuse to serve a model trained on other features
+        try:
+            self.schema.checkModel(getModelDataValues(filename), getModelInputSize(model))
+        except FeatureSchemaException as e:
+            raise ModelRegistryException('Model %s does not match --dt-values: %s' % (filename, str(e)))
+
+        entry = ModelEntry(name, filename, model)
+
+        # the first prediction is slow, get it done before the model takes requests
+        entry.predict(np.zeros((1, len(self.schema)), dtype=np.float32))
+
+        return entry
+
+    def loadAll(self):
+        """Load all models.
+
+        Returns:
+            bool -- True if all models were loaded.
+        """
+        try:
+            for (name, filename) in self.files.items():
+                self.models[name] = self._load(name, filename)
+        except Exception as e:
+            self.log.error('Could not load model: %s' % (str(e)))
+            return False
+
+        self.log.info('Loaded %d models: %s' % (len(self.models), ', '.join(sorted(self.models))))
+        return True
+
+    def get(self, name=None):
+        """Get a model by name.
+
+        Arguments:
+            name {string} -- Name of the model, None for the default model.
+
+        Returns:
+            ModelEntry -- The model, None if there is no model with the name.
+        """
+        return self.models.get(DEFAULT_MODEL if name is None else name)
+
+    def getModelIds(self):
+        """Get the identities of the loaded models.
+        
+        Returns:
+            list -- Model identities.
+        """
+        return [entry.modelId for entry in self.models.values()]
+
+    def reload(self, names=None):
+        """Load models again from their files and swap them in. A model that
+        fails to load is kept as it is.
+
+        Arguments:
+            names {list} -- Names of the models to reload, None for all models.
+
+        Returns:
+            list -- Names of the models that were reloaded.
+        """
+        reloaded = []
+
+        with self.reloadLock:
+            for name in (names if names is not None else list(self.files)):
+                try:
+                    entry = self._load(name, self.files[name])
+                except Exception as e:
+                    self.log.error('Failed reloading model %s, keeping the loaded one: %s' % (name, str(e)))
+                    self.failed[name] = getModelId(self.files[name])
+                    continue
+
+                # requests in progress keep the entry they started with
+                models = dict(self.models)
+                models[name] = entry
+                self.models = models
+
+                reloaded.append(name)
+                self.log.info('Reloaded model %s from %s.' % (name, entry.filename))
+
+        return reloaded
+
+    def reloadAsync(self, names=None):
+        """Reload models in the background, see reload().
+
+        Arguments:
+            names {list} -- Names of the models to reload, None for all models.
+        """
+        Thread(target=self.reload, args=(names,), daemon=True).start()
+
+    def getChanged(self):
+        """Get the models whose file changed since they were loaded, skipping
+        files that already failed to load.
+
+        Returns:
+            list -- Names of the models.
+        """
+        models = self.models
+        changed = []
+
+        for name in self.files:
+            modelId = getModelId(self.files[name])
+            if modelId != models[name].modelId and modelId != self.failed.get(name):
+                changed.append(name)
+
+        return changed
+
+    def _watch_thread(self):
+        while not self.stopEvent.wait(self.watchInterval):
+            changed = self.getChanged()
+
+            if len(changed) > 0:
+                self.log.info('Model files changed: %s' % (', '.join(changed)))
+                self.reload(changed)
+
+    def start(self):
+        if self.watch:
+            self.thread = Thread(target=self._watch_thread, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopEvent.set()
+
+    def getStats(self):
+        """Get the loaded models.
+
+        Returns:
+            dict -- File, identity and age in seconds of each model by name.
+        """
+        models = self.models
+
+        return dict((name, {
+            'file': entry.filename,
+            'id': entry.modelId,
+            'age': time.time() - entry.loadedAt
+        }) for (name, entry) in models.items())
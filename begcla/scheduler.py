@@ -0,0 +1,147 @@
+import time
+from threading import Thread, Lock
+from queue import Queue, Full, Empty
+from concurrent.futures import Future
+
+class ServerBusyException(Exception):
+    pass
+
+class DeadlineExceededException(Exception):
+    pass
+
+class ScheduledRequest:
+    def __init__(self, fn, args, deadline):
+        self.fn = fn
+        self.args = args
+        self.deadline = deadline
+        self.queuedAt = time.monotonic()
+        self.future = Future()
+
+class RequestScheduler:
+    def __init__(self, log, workers, queueSize, metrics=None):
+        """Runs requests on a fixed pool of worker threads, fed by a bounded
+        work queue. Requests are refused when the queue is full, and dropped
+        without running when their deadline passed while they were queued.
+
+        Arguments:
+            log {Logger} -- Logger to use.
+            workers {int} -- Number of worker threads.
+            queueSize {int} -- Max number of requests waiting for a worker.
+            metrics {Metrics} -- Metrics to record the queue wait in, if any.
+        """
+        self.log = log
+        self.metrics = metrics
+        self.workers = workers
+        self.queueSize = queueSize
+        self.queue = Queue(maxsize=queueSize)
+        self.threads = []
+        self.running = False
+        self.statsLock = Lock()
+        self.completed = 0
+        self.rejected = 0
+        self.shed = 0
+
+    def start(self):
+        self.running = True
+        for _ in range(self.workers):
+            t = Thread(target=self._worker_thread, daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def stop(self):
+        self.running = False
+
+        # requests queued before the sentinels are still answered
+        for _ in self.threads:
+            self.queue.put(None)
+
+        for t in self.threads:
+            t.join()
+
+        self.threads = []
+
+        # fail requests that raced the shutdown so no client hangs
+        while True:
+            try:
+                request = self.queue.get_nowait()
+            except Empty:
+                break
+
+            if request is not None:
+                request.future.set_exception(ServerBusyException('Scheduler stopped.'))
+
+    def submit(self, fn, *args, deadline=None):
+        """Queue a call for the worker pool.
+
+        Arguments:
+            fn {callable} -- Function to call.
+            args -- Arguments to call it with.
+            deadline {float} -- time.monotonic() value after which the call is no longer wanted, None for no deadline.
+
+        Raises:
+            ServerBusyException -- The work queue is full.
+
+        Returns:
+            Future -- Future resolving to the return value of the call.
+        """
+        if not self.running:
+            raise ServerBusyException('Scheduler is not running.')
+
+        request = ScheduledRequest(fn, args, deadline)
+
+        try:
+            self.queue.put_nowait(request)
+        except Full:
+            with self.statsLock:
+                self.rejected += 1
+            raise ServerBusyException('Work queue is full.')
+
+        return request.future
+
+    def getStats(self):
+        """Get statistics of the scheduler.
+
+        Returns:
+            dict -- Scheduler statistics.
+        """
+        with self.statsLock:
+            return {
+                'workers': self.workers,
+                'queued': self.queue.qsize(),
+                'queueSize': self.queueSize,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'shed': self.shed
+            }
+
+    def _run(self, request):
+        if self.metrics is not None:
+            self.metrics.observe('queue_wait', time.monotonic() - request.queuedAt)
+
+        if request.deadline is not None and time.monotonic() > request.deadline:
+            # the client has given up on this request by now, don't spend a worker on it
+            self.log.debug('Shedding request after %.1f ms in the queue, past its deadline.' % ((time.monotonic() - request.queuedAt)*1000))
+            with self.statsLock:
+                self.shed += 1
+            request.future.set_exception(DeadlineExceededException('Deadline passed while queued.'))
+            return
+
+        if not request.future.set_running_or_notify_cancel():
+            return
+
+        try:
+            request.future.set_result(request.fn(*request.args))
+        except Exception as e:
+            request.future.set_exception(e)
+
+        with self.statsLock:
+            self.completed += 1
+
+    def _worker_thread(self):
+        while True:
+            request = self.queue.get()
+
+            if request is None:
+                break
+
+            self._run(request)
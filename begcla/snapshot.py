@@ -0,0 +1,296 @@
+import os
+import json
+import time
+import numpy as np
+from struct import pack, unpack
+from threading import Thread, Event, RLock
+
+# snapshot file: magic, version, metadata size, json metadata, aligned column arrays
+SNAPSHOT_MAGIC = b'BCSS'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_ALIGNMENT = 64
+
+class Snapshot:
+    def __init__(self, filename):
+        """Memory-mapped player feature snapshot, indexed by login.
+        
+        Arguments:
+            filename {string} -- Path to the snapshot file.
+        """
+        with open(filename, 'rb') as f:
+            (magic, version, metaSize) = unpack('<4sII', f.read(12))
+            if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+                raise Exception("'%s' is not a supported snapshot." % (filename))
+
+            meta = json.loads(f.read(metaSize).decode('utf8'))
+
+        dataStart = 12 + metaSize
+        dataStart += -dataStart % SNAPSHOT_ALIGNMENT
+        data = np.memmap(filename, dtype=np.uint8, mode='r')
+
+        def getArray(info):
+            return np.ndarray(info['shape'], dtype=info['dtype'], buffer=data, offset=dataStart + info['offset'])
+
+        self.created = meta['created']
+        self.features = meta['features']
+        self.logins = getArray(meta['logins'])
+        self.ids = getArray(meta['ids'])
+        self.columns = getArray(meta['columns'])
+
+    def __len__(self):
+        return len(self.logins)
+
+    def lookup(self, logins):
+        """Get the datapoints of players.
+        
+        Arguments:
+            logins {list} -- Login names of players.
+        
+        Returns:
+            dict -- Datapoint of each login found in the snapshot.
+        """
+        if len(logins) == 0 or len(self.logins) == 0:
+            return {}
+
+        encoded = [login.lower().encode('utf8') for login in logins]
+        keys = np.array(encoded, dtype=self.logins.dtype)
+        pos = np.minimum(np.searchsorted(self.logins, keys), len(self.logins) - 1)
+
+        # logins longer than the stored ones are truncated in keys, they can't be in the snapshot
+        fits = np.array([len(key) <= self.logins.dtype.itemsize for key in encoded])
+        found = np.nonzero((self.logins[pos] == keys) & fits)[0]
+        points = self.columns[:, pos[found]].T
+
+        return {logins[i]: points[j] for (j, i) in enumerate(found)}
+
+    @staticmethod
+    def write(filename, chunks, features, created=None):
+        """Write a snapshot of player stats.
+        
+        Arguments:
+            filename {string} -- Path to the snapshot file, replaced atomically.
+            chunks {iterable} -- Lists of stats dicts as returned by EvoSCDB, only one is held at a time.
+            features {list} -- Names of the features to store.
+            created {float} -- Time the stats were read at, now if None.
+        
+        Returns:
+            int -- Number of players written.
+        """
+        loginChunks = []
+        idChunks = []
+        columnChunks = []
+
+        # keep only the compact columns of each chunk, not its dicts
+        for players in chunks:
+            if len(players) == 0:
+                continue
+
+            loginChunks.append(np.array([player['login'].lower().encode('utf8') for player in players], dtype=bytes))
+            idChunks.append(np.array([player['id'] for player in players], dtype=np.int64))
+            columnChunks.append(np.array([[player[name] for player in players] for name in features], dtype=np.float32).reshape((len(features), len(players))))
+
+        if len(loginChunks) == 0:
+            logins = np.array([], dtype='S1')
+            ids = np.zeros(0, dtype=np.int64)
+            columns = np.zeros((len(features), 0), dtype=np.float32)
+        else:
+            # lookups binary search the logins
+            logins = np.concatenate(loginChunks)
+            del loginChunks
+            order = np.argsort(logins, kind='stable')
+            logins = logins[order]
+            ids = np.concatenate(idChunks)[order]
+            del idChunks
+            columns = np.concatenate(columnChunks, axis=1)[:, order]
+            del columnChunks
+
+        arrays = [
+            ('logins', logins),
+            ('ids', ids),
+            ('columns', columns)
+        ]
+
+        meta = {
+            'created': time.time() if created is None else created,
+            'features': features
+        }
+        offset = 0
+        for (name, array) in arrays:
+            meta[name] = {'offset': offset, 'shape': list(array.shape), 'dtype': array.dtype.str}
+            offset += -(-array.nbytes // SNAPSHOT_ALIGNMENT) * SNAPSHOT_ALIGNMENT
+
+        metaBytes = json.dumps(meta).encode('utf8')
+        header = SNAPSHOT_MAGIC + pack('<II', SNAPSHOT_VERSION, len(metaBytes)) + metaBytes
+        header += b'\0' * (-len(header) % SNAPSHOT_ALIGNMENT)
+
+        # per process, so writers never share a temp file
+        tmpFile = '%s.%d.tmp' % (filename, os.getpid())
+        with open(tmpFile, 'wb') as f:
+            f.write(header)
+            for (name, array) in arrays:
+                f.write(np.ascontiguousarray(array).data)
+                f.write(b'\0' * (-array.nbytes % SNAPSHOT_ALIGNMENT))
+
+        os.replace(tmpFile, filename)
+
+        return len(logins)
+
+def _getFileId(filename):
+    # changes when the file is replaced
+    try:
+        info = os.stat(filename)
+    except OSError:
+        return None
+
+    return (info.st_ino, info.st_mtime_ns)
+
+class FeatureStore:
+    # seconds between checks for a snapshot written by another process
+    RELOAD_INTERVAL = 5
+
+    def __init__(self, config, log, db, schema):
+        """Serves player datapoints from a local snapshot that is refreshed
+        from the database in the background. With several server processes
+        only one of them refreshes the snapshot, the others load it again
+        when the file changes.
+        
+        Arguments:
+            config {ConfigParser} -- Configuration, settings are read from the [Snapshot] section.
+            log {Logger} -- Logger to use.
+            db {EvoSCDB} -- Database to export the stats from.
+            schema {FeatureSchema} -- Features to store.
+        """
+        self.log = log
+        self.db = db
+        self.schema = schema
+        self.filename = config['Snapshot'].get('File', 'snapshot.bin')
+        self.refreshInterval = float(config['Snapshot'].get('RefreshInterval', '600'))
+        self.chunkSize = int(config['Snapshot'].get('ChunkSize', '5000'))
+        self.snapshot = None
+        self.fileId = None
+        self.refresher = True
+        # logins whose stats changed, by invalidation time, they skip snapshots read before that
+        self.overrides = {}
+        self.lock = RLock()
+        self.hits = 0
+        self.misses = 0
+        self.stopEvent = Event()
+        self.thread = None
+
+        if os.path.exists(self.filename):
+            self._load()
+
+    def _load(self):
+        fileId = _getFileId(self.filename)
+
+        try:
+            snapshot = Snapshot(self.filename)
+        except Exception as e:
+            self.log.error('Failed loading snapshot %s: %s' % (self.filename, str(e)))
+            return
+
+        # a file that can't be used isn't tried again until it changes
+        self.fileId = fileId
+
+        if snapshot.features != self.schema.names:
+            self.log.warning('Snapshot %s has other features than the model, ignoring it.' % (self.filename))
+            return
+
+        with self.lock:
+            self.overrides = dict((login, at) for (login, at) in self.overrides.items() if at >= snapshot.created)
+
+        self.snapshot = snapshot
+        self.log.info('Loaded snapshot of %d players (%d seconds old).' % (len(snapshot), time.time() - snapshot.created))
+
+    def refresh(self):
+        """Export the stats of all players from the database into a new snapshot."""
+        start = time.time()
+
+        count = Snapshot.write(self.filename, self.db.iterPlayerStats(self.chunkSize), self.schema.names, start)
+        self._load()
+        self.log.info('Refreshed snapshot of %d players in %.1f seconds.' % (count, time.time() - start))
+
+    def _refresh_thread(self):
+        while True:
+            age = self.getAge()
+            wait = 0 if age is None else max(self.refreshInterval - age, 0)
+
+            if self.stopEvent.wait(wait):
+                return
+
+            try:
+                self.refresh()
+            except Exception as e:
+                self.log.error('Snapshot refresh failed: ' + str(e), stack_info=e)
+                if self.stopEvent.wait(self.refreshInterval):
+                    return
+
+    def _reload_thread(self):
+        while not self.stopEvent.wait(FeatureStore.RELOAD_INTERVAL):
+            fileId = _getFileId(self.filename)
+
+            if fileId is not None and fileId != self.fileId:
+                self._load()
+
+    def start(self):
+        target = self._refresh_thread if self.refresher else self._reload_thread
+        self.thread = Thread(target=target, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopEvent.set()
+
+    def getAge(self):
+        snapshot = self.snapshot
+        return None if snapshot is None else time.time() - snapshot.created
+
+    def lookup(self, logins):
+        """Get the datapoints of players from the snapshot.
+        
+        Arguments:
+            logins {list} -- Login names of players.
+        
+        Returns:
+            dict -- Datapoint of each login found in the snapshot.
+        """
+        snapshot = self.snapshot
+        overrides = self.overrides
+        found = logins
+
+        if len(overrides) > 0:
+            found = [login for login in logins if login.lower() not in overrides]
+
+        points = {} if snapshot is None else snapshot.lookup(found)
+
+        with self.lock:
+            self.hits += len(points)
+            self.misses += len(logins) - len(points)
+
+        return points
+
+    def invalidate(self, logins):
+        """Serve players from the database instead of the snapshot, until a
+        snapshot read after now is loaded.
+        
+        Arguments:
+            logins {list} -- Login names of players.
+        """
+        now = time.time()
+
+        with self.lock:
+            overrides = dict(self.overrides)
+            for login in logins:
+                overrides[login.lower()] = now
+            self.overrides = overrides
+
+    def getStats(self):
+        with self.lock:
+            total = self.hits + self.misses
+
+            return {
+                'players': 0 if self.snapshot is None else len(self.snapshot),
+                'age': self.getAge(),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': 0 if total == 0 else self.hits / total
+            }
@@ -0,0 +1,225 @@
+from struct import pack, unpack_from, calcsize
+
+# the 4-byte packet header holds the body size in the low 24 bits and flags in the high 8 bits
+HEADER_SIZE_MASK = 0xFFFFFF
+HEADER_FLAGS_SHIFT = 24
+FLAG_BINARY = 0x01
+
+MAX_BODY_SIZE = HEADER_SIZE_MASK
+
+MSG_PREDICT = 1
+MSG_PREDICTIONS = 2
+
+MSGFLAG_KEEPALIVE = 0x01
+MSGFLAG_ID = 0x02
+MSGFLAG_PARTIAL = 0x04
+MSGFLAG_STREAM = 0x08
+MSGFLAG_MODEL = 0x10
+
+_HEAD = '<BBI'
+_PREDICTION = '<Bff'
+
+# keys the binary messages can carry
+_REQUEST_KEYS = frozenset(['request', 'logins', 'model', 'keepalive', 'stream', 'id'])
+_RESPONSE_KEYS = frozenset(['errno', 'model', 'predictions', 'partial', 'id'])
+_PREDICTION_KEYS = frozenset(['login', 'success', 'experienced', 'beginner'])
+_FAILED_PREDICTION_KEYS = frozenset(['login', 'success', 'error'])
+
+def makeHeader(size, flags):
+    if size > MAX_BODY_SIZE:
+        raise ValueError('Packet body of %d bytes exceeds the max size of %d bytes.' % (size, MAX_BODY_SIZE))
+
+    return pack('<I', size | (flags << HEADER_FLAGS_SHIFT))
+
+def splitHeader(header):
+    """Split a packet header value into body size and flags.
+    
+    Arguments:
+        header {int} -- Header as unsigned integer.
+    
+    Returns:
+        tuple -- Body size and flags.
+    """
+    return (header & HEADER_SIZE_MASK, header >> HEADER_FLAGS_SHIFT)
+
+def makePredictRequest(logins, stream=False):
+    """Make the data of a predict request, with only the fields that are set
+    so it can be sent in the binary format.
+    
+    Arguments:
+        logins {list} -- Login names of players.
+        stream {bool} -- Whether to get the results in chunks as they are ready.
+    
+    Returns:
+        dict -- Request data.
+    """
+    data = {
+        'request': 'predict',
+        'logins': logins
+    }
+
+    if stream:
+        data['stream'] = True
+
+    return data
+
+def _packHead(msgType, data, keepalive):
+    flags = 0
+    msgId = 0
+
+    if keepalive:
+        flags |= MSGFLAG_KEEPALIVE
+    if data.get('partial', False) is True:
+        flags |= MSGFLAG_PARTIAL
+    if data.get('stream', False) is True:
+        flags |= MSGFLAG_STREAM
+    if type(data.get('id')) is int and 0 <= data['id'] <= 0xFFFFFFFF:
+        flags |= MSGFLAG_ID
+        msgId = data['id']
+    if 'model' in data:
+        flags |= MSGFLAG_MODEL
+
+    head = pack(_HEAD, msgType, flags, msgId)
+
+    # the model name follows the head, like a login
+    if 'model' in data:
+        head += _packLogin(data['model'])
+
+    return head
+
+def _notFound(login):
+    return 'Player ' + login + ' not found.'
+
+def _packLogin(login):
+    encoded = login.encode('utf8')
+    return pack('<B', len(encoded)) + encoded
+
+def _isLogin(login):
+    return type(login) is str and len(login.encode('utf8')) <= 255
+
+def _isFloat32(value):
+    # only values that survive the f32 round trip unchanged are encoded
+    return type(value) is float and unpack_from('<f', pack('<f', value))[0] == value
+
+def _canEncodePrediction(prediction):
+    if type(prediction) is not dict or not _isLogin(prediction.get('login')):
+        return False
+
+    if prediction.get('success') is True:
+        return set(prediction) == _PREDICTION_KEYS and _isFloat32(prediction['experienced']) and _isFloat32(prediction['beginner'])
+
+    # the error of a failed prediction is not sent, decodeBinary restores it
+    return prediction.get('success') is False and set(prediction) == _FAILED_PREDICTION_KEYS and prediction['error'] == _notFound(prediction['login'])
+
+def _canEncode(data, keys):
+    # anything outside the fixed set of keys and values is sent as json, so nothing is lost
+    if not set(data) <= keys:
+        return False
+
+    if 'id' in data and (type(data['id']) is not int or not 0 <= data['id'] <= 0xFFFFFFFF):
+        return False
+
+    if 'model' in data and not _isLogin(data['model']):
+        return False
+
+    return all(data[flag] is True for flag in ('keepalive', 'stream', 'partial') if flag in data)
+
+def encodeBinary(data):
+    """Encode a predict request or response in the binary format.
+    
+    Arguments:
+        data {dict} -- Packet data.
+    
+    Returns:
+        bytes -- Encoded body, None if the data can't be encoded without loss (it is then sent as json).
+    """
+    if type(data) is not dict:
+        return None
+
+    if data.get('request') == 'predict' and type(data.get('logins')) is list and _canEncode(data, _REQUEST_KEYS):
+        if not all(_isLogin(login) for login in data['logins']):
+            return None
+
+        parts = [_packHead(MSG_PREDICT, data, data.get('keepalive', False) is True), pack('<I', len(data['logins']))]
+        parts.extend(_packLogin(login) for login in data['logins'])
+        return b''.join(parts)
+
+    if type(data.get('errno')) is int and data['errno'] == 0 and type(data.get('predictions')) is list and _canEncode(data, _RESPONSE_KEYS):
+        if not all(_canEncodePrediction(p) for p in data['predictions']):
+            return None
+
+        parts = [_packHead(MSG_PREDICTIONS, data, False), pack('<I', len(data['predictions']))]
+        for prediction in data['predictions']:
+            parts.append(_packLogin(prediction['login']))
+            if prediction.get('success', True):
+                parts.append(pack(_PREDICTION, 1, prediction['experienced'], prediction['beginner']))
+            else:
+                parts.append(pack(_PREDICTION, 0, 0, 0))
+
+        return b''.join(parts)
+
+    return None
+
+def decodeBinary(body):
+    """Decode a binary packet body.
+    
+    Arguments:
+        body {bytes} -- Encoded body.
+    
+    Returns:
+        dict -- Packet data, in the same shape as the json encoding.
+    """
+    body = memoryview(body)
+    (msgType, flags, msgId) = unpack_from(_HEAD, body, 0)
+    offset = calcsize(_HEAD)
+
+    model = None
+    if flags & MSGFLAG_MODEL:
+        size = body[offset]
+        model = bytes(body[offset + 1:offset + 1 + size]).decode('utf8')
+        offset += 1 + size
+
+    (count,) = unpack_from('<I', body, offset)
+    offset += 4
+
+    logins = []
+    values = []
+    for i in range(count):
+        size = body[offset]
+        logins.append(bytes(body[offset + 1:offset + 1 + size]).decode('utf8'))
+        offset += 1 + size
+
+        if msgType == MSG_PREDICTIONS:
+            values.append(unpack_from(_PREDICTION, body, offset))
+            offset += calcsize(_PREDICTION)
+
+    if msgType == MSG_PREDICT:
+        data = {
+            'request': 'predict',
+            'logins': logins
+        }
+        if flags & MSGFLAG_KEEPALIVE:
+            data['keepalive'] = True
+        if flags & MSGFLAG_STREAM:
+            data['stream'] = True
+    elif msgType == MSG_PREDICTIONS:
+        data = {
+            'errno': 0,
+            'predictions': []
+        }
+        for (login, (success, experienced, beginner)) in zip(logins, values):
+            if success:
+                data['predictions'].append({'login': login, 'success': True, 'experienced': experienced, 'beginner': beginner})
+            else:
+                data['predictions'].append({'login': login, 'success': False, 'error': _notFound(login)})
+        if flags & MSGFLAG_PARTIAL:
+            data['partial'] = True
+    else:
+        raise ValueError('Unknown binary message type %d.' % (msgType))
+
+    if flags & MSGFLAG_ID:
+        data['id'] = msgId
+    if model is not None:
+        data['model'] = model
+
+    return data
@@ -3,7 +3,7 @@ import os
 import logging
 import argparse
 
-from begcla.commands import cmd_classify, cmd_dataset, cmd_model, cmd_server
+from begcla.commands import cmd_classify, cmd_dataset, cmd_export, cmd_model, cmd_score, cmd_server, cmd_sweep
 from begcla.pidfile import PidFile, PidFileException
 
 ###################################################
@@ -51,24 +51,54 @@ cmdSubParsers = cmdParser.add_subparsers(dest='cmd')
 
 datasetCmdParser = cmdSubParsers.add_parser("dataset", help='Create datasets model generator.')
 datasetCmdParser.add_argument('--out', dest='dataset_file', help='CSV-file to output the dataset to (will append).', required=True)
+datasetCmdParser.add_argument('--from-json', dest='from_json', help='Build the dataset from a vote export json file without the interactive menu.', default=None)
+datasetCmdParser.add_argument('--batch-size', dest='batch_size', help='Number of players to fetch per database query.', default=500, type=int)
+datasetCmdParser.add_argument('--workers', dest='workers', help='Max number of concurrent database lookups, each with its own database connection.', default=4, type=int)
 
 modelCmdParser = cmdSubParsers.add_parser("model", help='Generate classifier models.')
-modelCmdParser.add_argument('--dataset', dest='dataset_file', help='CSV-file containing data points used for training.', required=True)
-modelCmdParser.add_argument('--batch-size', dest='batch_size', help='Size of training batches.', default=100)
-modelCmdParser.add_argument('--epochs', dest='epochs', help='Number of training epochs.', default=32)
-modelCmdParser.add_argument('--out-layer-activation', dest='outlayer_activation', help='Activation function on output layer.', default='softmax')
-modelCmdParser.add_argument('--inner-layers', dest='inner_layers', help='List of hidden layers (format size:activation).', default=["50:sigmoid"], nargs='+')
+modelCmdParser.add_argument('--dataset', dest='dataset_file', help='CSV-files (or glob patterns of them) containing data points used for training.', required=True, nargs='+')
+modelCmdParser.add_argument('--batch-size', dest='batch_size', help='Size of training batches.', default=cmd_model.DEFAULT_OPTIONS['batch_size'])
+modelCmdParser.add_argument('--epochs', dest='epochs', help='Number of training epochs.', default=cmd_model.DEFAULT_OPTIONS['epochs'])
+modelCmdParser.add_argument('--out-layer-activation', dest='outlayer_activation', help='Activation function on output layer.', default=cmd_model.DEFAULT_OPTIONS['outlayer_activation'])
+modelCmdParser.add_argument('--inner-layers', dest='inner_layers', help='List of hidden layers (format size:activation).', default=cmd_model.DEFAULT_OPTIONS['inner_layers'], nargs='+')
 modelCmdParser.add_argument('--dt-values', dest='db_values', help='Data-point values to use (visits,play_time,finishes,locals,wins,score,rank,record_rank_avg,num_pbs).', default="finishes,locals,wins,score,rank")
-modelCmdParser.add_argument('--in-layer-size', dest='inlayer_size', help='Size of the input layer.', default=32)
-modelCmdParser.add_argument('--in-layer-activation', dest='inlayer_activation', help='Activation function of the input layer', default='relu')
-modelCmdParser.add_argument('--optimizer', dest='optimizer', help='Model compilation optimizer.', default='rmsprop')
-modelCmdParser.add_argument('--loss', dest='loss', help='Model compilation loss function.', default='binary_crossentropy')
-modelCmdParser.add_argument('--metrics', dest='metrics', help='Metrics to use for the training.', default=["accuracy"], nargs='+')
+modelCmdParser.add_argument('--in-layer-size', dest='inlayer_size', help='Size of the input layer.', default=cmd_model.DEFAULT_OPTIONS['inlayer_size'])
+modelCmdParser.add_argument('--in-layer-activation', dest='inlayer_activation', help='Activation function of the input layer', default=cmd_model.DEFAULT_OPTIONS['inlayer_activation'])
+modelCmdParser.add_argument('--optimizer', dest='optimizer', help='Model compilation optimizer.', default=cmd_model.DEFAULT_OPTIONS['optimizer'])
+modelCmdParser.add_argument('--loss', dest='loss', help='Model compilation loss function.', default=cmd_model.DEFAULT_OPTIONS['loss'])
+modelCmdParser.add_argument('--metrics', dest='metrics', help='Metrics to use for the training.', default=cmd_model.DEFAULT_OPTIONS['metrics'], nargs='+')
 modelCmdParser.add_argument('--out', dest='out_file', help='File to save the model to.', default='model.h5')
+modelCmdParser.add_argument('--validation-split', dest='validation_split', help='Fraction of the players held out for validation.', default=0.0, type=float)
+modelCmdParser.add_argument('--stream', dest='stream', help='Stream batches from the dataset files instead of loading them into memory.', default=False, action="store_true")
+modelCmdParser.add_argument('--workers', dest='workers', help='Number of processes parsing the dataset files when streaming.', default=4, type=int)
+modelCmdParser.add_argument('--shuffle-buffer', dest='shuffle_buffer', help='Number of data points shuffled together when streaming.', default=100000, type=int)
+modelCmdParser.add_argument('--prefetch', dest='prefetch', help='Number of batches prepared ahead of training when streaming.', default=8, type=int)
+modelCmdParser.add_argument('--resume-from', dest='resume_from', help='Keras model file to continue training, on the new or changed data points only. The layers of the model are kept and the layer options are ignored.', default=None)
+modelCmdParser.add_argument('--replay', dest='replay', help='Number of data points the resumed model was trained on to train on again, per new or changed data point.', default=1.0, type=float)
+modelCmdParser.add_argument('--no-cache', dest='no_cache', help='Do not cache the parsed dataset next to the dataset file.', default=False, action="store_true")
+
+sweepCmdParser = cmdSubParsers.add_parser("sweep", help='Search model options with k-fold cross-validation.')
+sweepCmdParser.add_argument('--dataset', dest='dataset_file', help='CSV-files (or glob patterns of them) containing data points used for training.', required=True, nargs='+')
+sweepCmdParser.add_argument('--spec', dest='spec_file', help='JSON file with the search and the values to try for each model option.', required=True)
+sweepCmdParser.add_argument('--dt-values', dest='dt_values', help='Data-point values to use (visits,play_time,finishes,locals,wins,score,rank,record_rank_avg,num_pbs).', default="finishes,locals,wins,score,rank")
+sweepCmdParser.add_argument('--folds', dest='folds', help='Number of cross-validation folds.', default=5, type=int)
+sweepCmdParser.add_argument('--patience', dest='patience', help='Stop training a fold after this many epochs without a better validation loss.', default=5, type=int)
+sweepCmdParser.add_argument('--workers', dest='workers', help='Number of trials trained at the same time, each in its own process.', default=max(1, (os.cpu_count() or 1) // 2), type=int)
+sweepCmdParser.add_argument('--threads', dest='threads', help='Number of threads each trial may use.', default=1, type=int)
+sweepCmdParser.add_argument('--backend', dest='backend', help='Inference backend to measure the latency with (keras or numpy).', choices=['keras', 'numpy'], default=config['Classifier'].get('Backend', 'keras').lower())
+sweepCmdParser.add_argument('--report', dest='report_file', help='CSV-file to write the ranked results to.', default='sweep.csv')
+sweepCmdParser.add_argument('--no-cache', dest='no_cache', help='Do not cache the parsed dataset next to the dataset file.', default=False, action="store_true")
+
+exportCmdParser = cmdSubParsers.add_parser("export", help='Export a trained model to a compact file for the numpy backend.')
+exportCmdParser.add_argument('--model', dest='model_file', help='Keras model file (.h5) to export.', required=True)
+exportCmdParser.add_argument('--dt-values', dest='dt_values', help='Data-point values the model was trained on (visits,play_time,finishes,locals,wins,score,rank,record_rank_avg,num_pbs), only needed if the model does not record them.', default=None)
+exportCmdParser.add_argument('--float16', dest='float16', help='Store weights as float16 instead of float32 (smaller, but not memory-mapped when loaded).', default=False, action="store_true")
+exportCmdParser.add_argument('--out', dest='out_file', help='File to save the exported model to.', default='model.bcla')
 
 serverCmdParser = cmdSubParsers.add_parser("server", help='Serve a classifier prediction server.')
 serverCmdParser.add_argument('--dt-values', dest='dt_values', help='Data-point values to use (visits,play_time,finishes,locals,wins,score,rank,record_rank_avg,num_pbs).', default="finishes,locals,wins,score,rank")
 serverCmdParser.add_argument('--detach', dest='detach', help='Detach the server process and run it in the background.', default=False, action="store_true")
+serverCmdParser.add_argument('--workers', dest='workers', help='Number of server processes sharing the listening socket, each with its own model and database pool.', default=1, type=int)
 serverCmdParser.add_argument('--pid', dest='pid', help='Path to pid file.', default=config['Common']['PidFile'])
 
 classifyCmdParser = cmdSubParsers.add_parser("classify", help='Try to classify players beginners or advanced.')
@@ -76,8 +106,21 @@ classifyCmdParser.add_argument('--logins', dest='player_logins', help='List of l
 classifyCmdParser.add_argument('--model', dest='model_file', help='Path to the model file to use.', default='model.h5')
 classifyCmdParser.add_argument('--json', dest='json', help='Output in json format.', default=False, action="store_true")
 classifyCmdParser.add_argument('--server', dest='use_server', help='Run classification through the prediction server (the server must be running).', default=False, action="store_true")
+classifyCmdParser.add_argument('--stream', dest='stream', help='Print server results as they arrive instead of waiting for all logins (with --json, one json object per line).', default=False, action="store_true")
+classifyCmdParser.add_argument('--binary', dest='binary', help='Use the compact binary encoding when talking to the server.', default=False, action="store_true")
+classifyCmdParser.add_argument('--backend', dest='backend', help='Inference backend to use for local classification (keras or numpy).', choices=['keras', 'numpy'], default=config['Classifier'].get('Backend', 'keras').lower())
 classifyCmdParser.add_argument('--dt-values', dest='dt_values', help='Data-point values to use (visits,play_time,finishes,locals,wins,score,rank,record_rank_avg,num_pbs).', default="finishes,locals,wins,score,rank")
 
+scoreCmdParser = cmdSubParsers.add_parser("score", help='Classify all players in the database.')
+scoreCmdParser.add_argument('--model', dest='model_file', help='Path to the model file to use.', default=config['Classifier']['Model'])
+scoreCmdParser.add_argument('--backend', dest='backend', help='Inference backend to use (keras or numpy).', choices=['keras', 'numpy'], default=config['Classifier'].get('Backend', 'keras').lower())
+scoreCmdParser.add_argument('--dt-values', dest='dt_values', help='Data-point values to use (visits,play_time,finishes,locals,wins,score,rank,record_rank_avg,num_pbs).', default="finishes,locals,wins,score,rank")
+scoreCmdParser.add_argument('--out', dest='out_file', help='CSV-file to write the results to.', default=None)
+scoreCmdParser.add_argument('--table', dest='table', help='Database table to write the results to (created if missing).', default=None)
+scoreCmdParser.add_argument('--chunk-size', dest='chunk_size', help='Number of players fetched and classified at a time.', default=5000, type=int)
+scoreCmdParser.add_argument('--checkpoint', dest='checkpoint', help='File to save progress to; an interrupted run resumes from it.', default=None)
+scoreCmdParser.add_argument('--since', dest='since', help='Only score players whose stats changed at or after this time (YYYY-MM-DD HH:MM:SS).', default=None)
+
 args = cmdParser.parse_args()
 cmd = None
 fork = False
@@ -88,8 +131,14 @@ if args.cmd == 'dataset':
     cmd = cmd_dataset.CmdDataset(args, config, log)
 elif args.cmd == 'model':
     cmd = cmd_model.CmdModel(args, config, log)
+elif args.cmd == 'sweep':
+    cmd = cmd_sweep.CmdSweep(args, config, log)
+elif args.cmd == 'export':
+    cmd = cmd_export.CmdExport(args, config, log)
 elif args.cmd == 'classify':
     cmd = cmd_classify.CmdClassify(args, config, log)
+elif args.cmd == 'score':
+    cmd = cmd_score.CmdScore(args, config, log)
 elif args.cmd == 'server':
     fork = args.detach
 
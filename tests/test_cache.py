@@ -0,0 +1,71 @@
+import time
+import unittest
+from begcla.cache import PredictionCache
+
+class TestCache(unittest.TestCase):
+    def test_get_returns_put(self):
+        cache = PredictionCache(10, 60)
+        cache.put('default', 'snixtho', [0.25, 0.75])
+
+        self.assertEqual(cache.get('default', 'snixtho'), [0.25, 0.75])
+        self.assertIsNone(cache.get('candidate', 'snixtho'))
+        self.assertIsNone(cache.get('default', 'brakerb'))
+
+        stats = cache.getStats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+
+    def test_logins_are_case_insensitive(self):
+        cache = PredictionCache(10, 60)
+        cache.put('default', 'Snixtho', [0.25, 0.75])
+        cache.put('default', 'snixtho', [0.5, 0.5])
+
+        self.assertEqual(cache.getStats()['entries'], 1)
+        self.assertEqual(cache.get('default', 'SNIXTHO'), [0.5, 0.5])
+
+    def test_expired_entries_are_missed(self):
+        cache = PredictionCache(10, 0.01)
+        cache.put('default', 'snixtho', [0.25, 0.75])
+        time.sleep(0.02)
+
+        self.assertIsNone(cache.get('default', 'snixtho'))
+        self.assertEqual(cache.getStats()['entries'], 0)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = PredictionCache(2, 60)
+        cache.put('default', 'a', [0, 1])
+        cache.put('default', 'b', [0, 1])
+
+        # reading a makes b the least recently used
+        cache.get('default', 'a')
+        cache.put('default', 'c', [0, 1])
+
+        self.assertIsNotNone(cache.get('default', 'a'))
+        self.assertIsNone(cache.get('default', 'b'))
+        self.assertIsNotNone(cache.get('default', 'c'))
+        self.assertEqual(cache.getStats()['evictions'], 1)
+
+    def test_invalidate_removes_all_models(self):
+        cache = PredictionCache(10, 60)
+        cache.put('default', 'snixtho', [0, 1])
+        cache.put('candidate', 'snixtho', [0, 1])
+        cache.put('default', 'brakerb', [0, 1])
+
+        self.assertEqual(cache.invalidate(['SNIXTHO', 'unknown']), 2)
+        self.assertIsNone(cache.get('default', 'snixtho'))
+        self.assertIsNone(cache.get('candidate', 'snixtho'))
+        self.assertIsNotNone(cache.get('default', 'brakerb'))
+
+    def test_retain_models_drops_replaced_models(self):
+        cache = PredictionCache(10, 60)
+        cache.put('default@1', 'snixtho', [0, 1])
+        cache.put('default@1', 'brakerb', [0, 1])
+        cache.put('candidate@1', 'snixtho', [0, 1])
+
+        self.assertEqual(cache.retainModels(['default@2', 'candidate@1']), 2)
+        self.assertFalse(cache.hasModel('default@1'))
+        self.assertTrue(cache.hasModel('candidate@1'))
+        self.assertEqual(cache.getStats()['entries'], 1)
+        self.assertEqual(cache.retainModels(['default@2', 'candidate@1']), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+import numpy as np
+from begcla.dataset import loadRows, loadDataset
+from begcla.features import DATASET_COLUMNS, FeatureSchema
+
+log = logging.getLogger('test')
+
+def makeRow(playerId, label, value=1):
+    return ','.join([str(playerId)] + [str(value)] * (len(DATASET_COLUMNS) - 2) + [str(label)])
+
+class TestDataset(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'dataset.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, lines):
+        with open(self.filename, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def test_valid_rows_are_loaded(self):
+        self._write([makeRow(1, 0), '', makeRow(2, 1, 2.5)])
+        rows = loadRows(self.filename, log)
+
+        self.assertEqual(rows.shape, (2, len(DATASET_COLUMNS)))
+        self.assertEqual(list(rows[:, 0]), [1, 2])
+        self.assertEqual(rows[1, 1], 2.5)
+
+    def test_invalid_rows_are_skipped(self):
+        self._write([
+            makeRow(1, 0),
+            makeRow(2, 1) + ',3',
+            makeRow(3, 1).replace('1', 'x', 2),
+            makeRow(4, 1, 'nan'),
+            makeRow(5, 1, 'inf'),
+            makeRow(6, 2),
+            makeRow(7, 1)
+        ])
+
+        with self.assertLogs(log, 'WARNING'):
+            rows = loadRows(self.filename, log)
+
+        self.assertEqual(list(rows[:, 0]), [1, 7])
+
+    def test_cache_is_used(self):
+        self._write([makeRow(1, 0), makeRow(2, 1)])
+        cacheDir = os.path.join(self.dir, 'cache')
+        rows = loadRows(self.filename, log, cacheDir)
+
+        self.assertEqual(len(os.listdir(cacheDir)), 1)
+        np.testing.assert_array_equal(loadRows(self.filename, log, cacheDir), rows)
+
+    def test_dataset_uses_schema(self):
+        self._write([makeRow(1, 0), makeRow(2, 1)])
+        (points, labels) = loadDataset(self.filename, FeatureSchema(['wins', 'rank']), log)
+
+        self.assertEqual(points.shape, (2, 2))
+        self.assertEqual(points.dtype, np.float32)
+        self.assertEqual(list(labels), [0, 1])
+
+if __name__ == '__main__':
+    unittest.main()
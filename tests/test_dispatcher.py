@@ -0,0 +1,46 @@
+import logging
+import unittest
+from begcla.dispatcher import BatchDispatcher
+
+log = logging.getLogger('test')
+
+class TestDispatcher(unittest.TestCase):
+    def setUp(self):
+        self.batches = []
+        self.dispatcher = BatchDispatcher(self._predict, log, 100, 0.05)
+
+    def tearDown(self):
+        self.dispatcher.stop()
+
+    def _predict(self, points, key):
+        if key == 'broken':
+            raise ValueError('Model failed.')
+
+        self.batches.append((key, len(points)))
+        return [[key, point] for point in points]
+
+    def test_requests_are_batched(self):
+        # queued before the dispatcher runs, so they all land in one batch
+        requests = [self.dispatcher.submit([i, i + 10]) for i in range(3)]
+        self.dispatcher.start()
+
+        self.assertEqual([request.wait() for request in requests], [[[None, i], [None, i + 10]] for i in range(3)])
+        self.assertEqual(self.batches, [(None, 6)])
+
+    def test_batches_are_split_by_key(self):
+        requests = [self.dispatcher.submit([1], 'default'), self.dispatcher.submit([2], 'candidate'), self.dispatcher.submit([3], 'default')]
+        self.dispatcher.start()
+
+        self.assertEqual([request.wait() for request in requests], [[['default', 1]], [['candidate', 2]], [['default', 3]]])
+        self.assertEqual(sorted(self.batches), [('candidate', 1), ('default', 2)])
+
+    def test_errors_reach_every_request(self):
+        requests = [self.dispatcher.submit([1], 'broken'), self.dispatcher.submit([2], 'broken')]
+        self.dispatcher.start()
+
+        for request in requests:
+            with self.assertRaises(ValueError):
+                request.wait()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+import numpy as np
+from begcla.features import FEATURES, DATASET_COLUMNS, FeatureSchema, FeatureSchemaException
+
+class TestFeatures(unittest.TestCase):
+    def test_names_use_canonical_order(self):
+        self.assertEqual(FeatureSchema(['rank', 'finishes', 'wins']).names, ['finishes', 'wins', 'rank'])
+        self.assertEqual(FeatureSchema(['rank', 'finishes']), FeatureSchema(['finishes', 'rank']))
+
+    def test_unknown_value_is_refused(self):
+        with self.assertRaises(FeatureSchemaException):
+            FeatureSchema(['finishes', 'nope'])
+
+    def test_stats_and_rows_agree(self):
+        schema = FeatureSchema(['score', 'visits', 'num_pbs'])
+        stats = {name: i + 1 for (i, name) in enumerate(FEATURES)}
+        row = [0] + [stats[name] for name in FEATURES] + [1]
+
+        self.assertEqual(len(row), len(DATASET_COLUMNS))
+        np.testing.assert_array_equal(schema.fromStats([stats]), schema.fromRows(np.array([row], dtype=np.float64)))
+        self.assertEqual(schema.fromStats([]).shape, (0, 3))
+
+    def test_check_model_accepts_matching_model(self):
+        schema = FeatureSchema(['finishes', 'locals', 'wins'])
+
+        schema.checkModel(['wins', 'finishes', 'locals'], 3)
+        schema.checkModel(None, 3)
+        schema.checkModel(None, None)
+
+    def test_check_model_refuses_other_values(self):
+        schema = FeatureSchema(['finishes', 'locals', 'wins'])
+
+        with self.assertRaises(FeatureSchemaException):
+            schema.checkModel(['finishes', 'locals', 'score'], 3)
+
+    def test_check_model_refuses_other_input_size(self):
+        schema = FeatureSchema(['finishes', 'locals', 'wins'])
+
+        with self.assertRaises(FeatureSchemaException):
+            schema.checkModel(None, 4)
+
+if __name__ == '__main__':
+    unittest.main()
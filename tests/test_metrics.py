@@ -0,0 +1,46 @@
+import unittest
+from begcla.metrics import Histogram, Metrics
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram_quantiles_use_bucket_bounds(self):
+        histogram = Histogram([0.001, 0.01, 0.1])
+
+        self.assertIsNone(histogram.getStats()['p50'])
+
+        for value in [0.0005] * 98 + [0.05, 5]:
+            histogram.observe(value)
+
+        stats = histogram.getStats()
+        self.assertEqual(stats['count'], 100)
+        self.assertEqual(stats['p50'], 0.001)
+        self.assertEqual(stats['p99'], 0.1)
+
+        (counts, _, count) = histogram.snapshot()
+        self.assertEqual(histogram.quantile(1, counts, count), float('inf'))
+
+    def test_counters_and_errors(self):
+        metrics = Metrics()
+        metrics.increment('responses', 2)
+        metrics.countError(16)
+        metrics.countError(16)
+
+        stats = metrics.getStats()
+        self.assertEqual(stats['counters'], {'responses': 2})
+        self.assertEqual(stats['errors'], {'16': 2})
+
+    def test_render_is_cumulative(self):
+        metrics = Metrics()
+        metrics.observe('inference', 0.0002)
+        metrics.observe('inference', 20)
+        metrics.countError(32)
+        text = metrics.render({'clients': 3, 'cache_entries': None})
+
+        self.assertIn('begcla_stage_seconds_bucket{stage="inference",le="0.00025"} 1', text)
+        self.assertIn('begcla_stage_seconds_bucket{stage="inference",le="+Inf"} 2', text)
+        self.assertIn('begcla_stage_seconds_count{stage="inference"} 2', text)
+        self.assertIn('begcla_errors_total{errno="32"} 1', text)
+        self.assertIn('begcla_clients 3', text)
+        self.assertNotIn('cache_entries', text)
+
+if __name__ == '__main__':
+    unittest.main()
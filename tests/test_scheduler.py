@@ -0,0 +1,65 @@
+import time
+import logging
+import unittest
+from threading import Event
+from begcla.scheduler import RequestScheduler, ServerBusyException, DeadlineExceededException
+
+log = logging.getLogger('test')
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = RequestScheduler(log, 1, 1)
+        self.scheduler.start()
+        self.release = Event()
+
+    def tearDown(self):
+        self.release.set()
+        self.scheduler.stop()
+
+    def _block(self):
+        # occupy the only worker until the test releases it
+        started = Event()
+
+        def blocked():
+            started.set()
+            self.release.wait()
+
+        future = self.scheduler.submit(blocked)
+        started.wait()
+        return future
+
+    def test_runs_requests(self):
+        self.assertEqual(self.scheduler.submit(lambda a, b: a + b, 1, 2).result(), 3)
+
+        future = self.scheduler.submit(lambda: 1 / 0)
+        self.assertIsInstance(future.exception(), ZeroDivisionError)
+
+    def test_full_queue_is_busy(self):
+        self._block()
+        queued = self.scheduler.submit(lambda: 'queued')
+
+        with self.assertRaises(ServerBusyException):
+            self.scheduler.submit(lambda: 'rejected')
+
+        self.release.set()
+        self.assertEqual(queued.result(), 'queued')
+        self.assertEqual(self.scheduler.getStats()['rejected'], 1)
+
+    def test_passed_deadline_is_shed(self):
+        self._block()
+        future = self.scheduler.submit(lambda: 'late', deadline=time.monotonic() + 0.01)
+        time.sleep(0.02)
+        self.release.set()
+
+        with self.assertRaises(DeadlineExceededException):
+            future.result()
+        self.assertEqual(self.scheduler.getStats()['shed'], 1)
+
+    def test_stopped_scheduler_is_busy(self):
+        self.scheduler.stop()
+
+        with self.assertRaises(ServerBusyException):
+            self.scheduler.submit(lambda: None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+from begcla.wire import encodeBinary, decodeBinary, makePredictRequest
+
+# every request and response shape the server accepts or sends
+REQUESTS = [
+    {'request': 'predict', 'logins': ['snixtho', 'brakerb']},
+    {'request': 'predict', 'logins': []},
+    {'request': 'predict', 'logins': ['snixtho'], 'keepalive': True, 'id': 7},
+    {'request': 'predict', 'logins': ['snixtho'], 'stream': True, 'id': 0xFFFFFFFF},
+    {'request': 'predict', 'logins': ['snixtho'], 'keepalive': False},
+    {'request': 'predict', 'logins': ['snixtho'], 'stream': False},
+    {'request': 'predict', 'logins': ['snixtho'], 'id': -1},
+    {'request': 'predict', 'logins': ['snixtho'], 'id': 'abc'},
+    {'request': 'predict', 'logins': ['snixtho'], 'deadline_ms': 250},
+    {'request': 'predict', 'logins': ['snixtho'], 'model': 'candidate'},
+    {'request': 'predict', 'logins': ['snixtho'], 'model': 'nope', 'keepalive': True, 'id': 2},
+    {'request': 'predict', 'logins': ['snixtho'], 'model': None},
+    {'request': 'predict', 'logins': ['snixtho'], 'model': 'x' * 256},
+    {'request': 'predict', 'logins': [1]},
+    {'request': 'predict', 'logins': ['x' * 256]},
+    {'request': 'invalidate', 'logins': ['snixtho']},
+    {'request': 'reload', 'model': 'candidate'},
+    {'request': 'stats', 'id': 1},
+    {'request': 'close'}
+]
+
+RESPONSES = [
+    {'errno': 0, 'predictions': [
+        {'login': 'snixtho', 'success': True, 'experienced': 0.25, 'beginner': 0.75},
+        {'login': 'brakerb', 'success': False, 'error': 'Player brakerb not found.'}
+    ]},
+    {'errno': 0, 'predictions': [], 'partial': True, 'id': 3},
+    {'errno': 0, 'predictions': [{'login': 'snixtho', 'success': True, 'experienced': 0.1, 'beginner': 0.9}]},
+    {'errno': 0, 'predictions': [{'login': 'snixtho', 'success': False, 'error': 'Database error.'}]},
+    {'errno': 0, 'predictions': [{'login': 'snixtho', 'success': 1, 'experienced': 0.25, 'beginner': 0.75}]},
+    {'errno': 0, 'model': 'default', 'predictions': []},
+    {'errno': 0, 'model': 'candidate', 'predictions': [{'login': 'snixtho', 'success': True, 'experienced': 0.5, 'beginner': 0.5}], 'partial': True, 'id': 9},
+    {'errno': 0, 'partial': False, 'predictions': []},
+    {'errno': False, 'predictions': []},
+    {'errno': 0, 'done': True, 'summary': {'total': 1, 'succeeded': 1, 'failed': 0}, 'errors': [], 'id': 3},
+    {'errno': 4, 'error': 'Invalid body.', 'id': 3},
+    {'errno': 0, 'closed': True, 'reason': 'Idle timeout.'},
+    {'errno': 0, 'stats': {'cache': None}},
+    {'errno': 0, 'invalidated': 2},
+    {'errno': 0, 'reloading': ['default']}
+]
+
+class TestWire(unittest.TestCase):
+    def assertLossless(self, data):
+        body = encodeBinary(data)
+        if body is not None:
+            self.assertEqual(decodeBinary(body), data)
+
+    def test_requests_round_trip(self):
+        for data in REQUESTS:
+            with self.subTest(data=data):
+                self.assertLossless(data)
+
+    def test_responses_round_trip(self):
+        for data in RESPONSES:
+            with self.subTest(data=data):
+                self.assertLossless(data)
+
+    def test_predict_uses_binary(self):
+        self.assertIsNotNone(encodeBinary(REQUESTS[0]))
+        self.assertIsNotNone(encodeBinary(REQUESTS[2]))
+        self.assertIsNotNone(encodeBinary(RESPONSES[0]))
+        self.assertIsNotNone(encodeBinary(RESPONSES[1]))
+
+    def test_classify_request_uses_binary(self):
+        # the requests sent by classify --server --binary, with and without --stream
+        for stream in (False, True):
+            with self.subTest(stream=stream):
+                data = makePredictRequest(['snixtho', 'brakerb'], stream)
+                body = encodeBinary(data)
+                self.assertIsNotNone(body)
+                self.assertEqual(decodeBinary(body), data)
+
+    def test_model_is_kept(self):
+        request = {'request': 'predict', 'logins': ['snixtho'], 'model': 'nope'}
+        response = {'errno': 0, 'model': 'candidate', 'predictions': []}
+        self.assertEqual(decodeBinary(encodeBinary(request))['model'], 'nope')
+        self.assertEqual(decodeBinary(encodeBinary(response))['model'], 'candidate')
+
+    def test_unknown_keys_fall_back(self):
+        self.assertIsNone(encodeBinary(dict(REQUESTS[0], deadline_ms=250)))
+        self.assertIsNone(encodeBinary(dict(RESPONSES[1], done=True)))
+
+if __name__ == '__main__':
+    unittest.main()